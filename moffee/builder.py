@@ -1,10 +1,140 @@
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 import os
-from jinja2 import Environment, FileSystemLoader
-from moffee.compositor import Page, PageOption, composite, parse_frontmatter
-from moffee.markdown import md
-from moffee.utils.md_helper import extract_title
-from moffee.utils.file_helper import redirect_paths, copy_assets, merge_directories
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, asdict
+from functools import lru_cache
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, meta
+from markupsafe import Markup
+from moffee import __version__
+from moffee.compositor import (
+    Page,
+    PageOption,
+    paginate,
+    parse_frontmatter,
+    split_frontmatter,
+    make_option,
+)
+from moffee.markdown import md, current_fingerprint, frozen_config
+from moffee.utils.md_helper import extract_title, rm_comments
+from moffee.utils.build_cache import BuildCache, MemoryCache, hash_key
+from moffee.utils.md_asset_ext import (
+    asset_registry,
+    current_registry,
+    record_assets,
+    replay_assets,
+)
+from moffee.utils.md_highlight_ext import (
+    cache as highlight_cache,
+    current_highlight_cache_dir,
+    current_highlight_limit,
+    highlight_cache_dir,
+    highlight_limit,
+)
+from moffee.utils.md_math_ext import (
+    MATH_MODES,
+    current_math_renderer,
+    get_math_renderer,
+    math_renderer,
+)
+from moffee.utils.bundle import (
+    BUNDLE_MODES,
+    bundle_directory,
+    inline_page,
+    localize_stylesheets,
+    vendor_files,
+    vendor_urls,
+)
+from moffee.utils.file_helper import (
+    AssetRegistry,
+    PathResolver,
+    merged_files,
+    place_assets,
+    prune_directory,
+    sync_directories,
+    write_atomic,
+)
+
+
+@dataclass
+class Document:
+    """
+    A markdown document parsed once and passed through every build stage.
+    `timings` holds the seconds spent in each stage, `stats` counters reported by the build.
+    Once rendered, `html` holds the page, `fragments` the html of each slide within it,
+    and `assets` the source path of each file in the assets directory.
+    """
+
+    source: str
+    content: str
+    front_matter: dict
+    options: PageOption
+    pages: List[Page]
+    title: Optional[str]
+    struct: dict
+    path: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    stats: Dict[str, int] = field(default_factory=dict)
+    html: Optional[str] = None
+    fragments: List[str] = field(default_factory=list)
+    assets: Dict[str, str] = field(default_factory=dict)
+
+    @contextmanager
+    def timed(self, stage: str):
+        """Add the time spent in the with-block to timings[stage]"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[stage] = self.timings.get(stage, 0.0) + elapsed
+
+
+def parse_document(source: str, path: Optional[str] = None) -> Document:
+    """
+    Parse a markdown document: front matter, options, pages, title and structure.
+
+    :param source: Markdown document as a string
+    :param path: Optional path the document was read from
+    :return: The parsed Document
+    """
+    start = time.perf_counter()
+    content, front_matter = split_frontmatter(rm_comments(source))
+    options = make_option(front_matter)
+    parsed = time.perf_counter()
+    pages = paginate(content, options)
+    paginated = time.perf_counter()
+    struct = retrieve_structure(pages)
+
+    return Document(
+        source=source,
+        content=content,
+        front_matter=front_matter,
+        options=options,
+        pages=pages,
+        title=extract_title(content),
+        struct=struct,
+        path=path,
+        timings={
+            "parse": parsed - start,
+            "composite": paginated - parsed,
+            "structure": time.perf_counter() - paginated,
+        },
+    )
+
+
+def load_document(document_path: str) -> Document:
+    """Read and parse the document at document_path"""
+    start = time.perf_counter()
+    with open(document_path, encoding="utf8") as f:
+        source = f.read()
+    read = time.perf_counter() - start
+
+    document = parse_document(source, document_path)
+    document.timings = {"read": read, **document.timings}
+    return document
 
 
 def read_options(document_path) -> PageOption:
@@ -55,27 +185,236 @@ def retrieve_structure(pages: List[Page]) -> dict:
     return {"page_meta": page_meta, "headings": headings}
 
 
-def render_jinja2(document: str, template_dir) -> str:
-    """Run jinja2 templating to create html"""
-    # Setup Jinja 2
-    env = Environment(loader=FileSystemLoader(template_dir))
+def deck_key(env: Environment, data: dict) -> str:
+    """
+    Cache key part shared by all slides of a deck. Covers moffee version, markdown setup,
+    how asset urls are resolved, formulas rendered and code highlighted, slide templates,
+    and the deck-wide template data that slide templates actually use.
+    """
+    sources = {}
+    names = set()
+    for name in env.list_templates(extensions=["html"]):
+        if name == "slide.html" or name.startswith("layouts/"):
+            sources[name], _, _ = env.loader.get_source(env, name)
+            names |= _template_variables(env, sources[name])
+
+    registry = current_registry()
+    renderer = current_math_renderer()
+    return hash_key(
+        __version__,
+        current_fingerprint(),
+        registry.fingerprint if registry is not None else None,
+        renderer.fingerprint if renderer is not None else None,
+        current_highlight_limit(),
+        sources,
+        {key: value for key, value in data.items() if key in names and key != "slides"},
+        len(data["slides"]) if "slides" in names else None,
+    )
+
+
+@lru_cache(maxsize=256)
+def _template_variables(env: Environment, source: str) -> frozenset:
+    """Variables a template source uses from its context"""
+    return frozenset(meta.find_undeclared_variables(env.parse(source)))
+
+
+def slide_key(page: Page, slide_number: int, deck: str) -> str:
+    """Cache key of a rendered slide, covering everything its fragment depends on"""
+    return hash_key(
+        deck,
+        slide_number,
+        page.raw_md,
+        asdict(page.option),
+        page.h1,
+        page.h2,
+        page.h3,
+    )
+
+
+# Environments of template directories used so far, see `make_environment`
+_environments: Dict[Tuple[Tuple[str, ...], Optional[str]], Environment] = {}
+
+
+def make_environment(template_dir, bytecode_dir: Optional[str] = None) -> Environment:
+    """
+    Get the Jinja2 environment rendering slides. Environments are kept for the lifetime
+    of the process, so templates are compiled once and only reloaded when their file changes.
+
+    :param template_dir: Template directory, or a list of directories searched in order
+    :param bytecode_dir: Optional directory storing compiled templates across processes
+    """
+    dirs = [template_dir] if isinstance(template_dir, str) else template_dir
+    key = (tuple(os.path.abspath(d) for d in dirs), bytecode_dir)
+    env = _environments.get(key)
+    if env is None:
+        bytecode_cache = None
+        if bytecode_dir is not None:
+            os.makedirs(bytecode_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+        env = Environment(
+            loader=FileSystemLoader(list(key[0])),
+            bytecode_cache=bytecode_cache,
+            auto_reload=True,
+        )
+        env.filters["markdown"] = md
+        _environments[key] = env
+    return env
+
+
+# State of a slide rendering process, set up once per process by `_init_worker`
+_worker = {}
+
+
+def _init_worker(
+    template_dir,
+    bytecode_dir,
+    data: dict,
+    registry_args: Optional[tuple],
+    math_args: Optional[tuple],
+    highlight_dir: Optional[str],
+    max_lines: Optional[int],
+):
+    env = make_environment(template_dir, bytecode_dir)
+    _worker["template"] = env.get_template("slide.html")
+    _worker["data"] = data
+    _worker["registry"] = AssetRegistry(*registry_args) if registry_args else None
+    _worker["math"] = get_math_renderer(*math_args) if math_args else None
+    _worker["highlight_dir"] = highlight_dir
+    _worker["max_lines"] = max_lines
+
+
+def _render_batch(indices: List[int]) -> List[Tuple[str, list]]:
+    """Render slides at indices in a worker process, with the urls each slide resolved"""
+    template, data, registry = _worker["template"], _worker["data"], _worker["registry"]
+    with frozen_config(), (
+        asset_registry(registry) if registry else nullcontext()
+    ), math_renderer(_worker["math"]), highlight_cache_dir(
+        _worker["highlight_dir"]
+    ), highlight_limit(
+        _worker["max_lines"]
+    ):
+        return [_render_slide(template, data, i) for i in indices]
+
+
+def _render_slide(template, data: dict, i: int) -> Tuple[str, list]:
+    with record_assets() as records:
+        html = template.render(data, slide=data["slides"][i], slide_number=i + 1)
+    return html, records
+
+
+def _render_parallel(
+    env: Environment, data: dict, indices: List[int], jobs: int
+) -> Iterator[Tuple[str, list]]:
+    """Render slides at indices over a pool of jobs processes, yielding results in order"""
+    registry = current_registry()
+    registry_args = (
+        (registry.document_path, registry.resource_dir, None, registry.url_prefix)
+        if registry is not None
+        else None
+    )
+    renderer = current_math_renderer()
+    math_args = (renderer.cache_dir,) if renderer is not None else None
+    # A few batches per process balance uneven slides without much messaging overhead
+    batch_size = -(-len(indices) // (jobs * 4))
+    batches = [
+        indices[start : start + batch_size]
+        for start in range(0, len(indices), batch_size)
+    ]
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(batches)),
+        initializer=_init_worker,
+        initargs=(
+            env.loader.searchpath,
+            getattr(env.bytecode_cache, "directory", None),
+            data,
+            registry_args,
+            math_args,
+            current_highlight_cache_dir(),
+            current_highlight_limit(),
+        ),
+    ) as executor:
+        for results in executor.map(_render_batch, batches):
+            for html, records in results:
+                # Register the assets found by the worker in this process
+                replay_assets(records)
+                yield html, records
 
-    env.filters["markdown"] = md
+
+def render_slides(
+    env: Environment,
+    pages: List[Page],
+    data: dict,
+    cache: Optional[Union[BuildCache, MemoryCache]] = None,
+    deck: Optional[str] = None,
+    jobs: int = 1,
+) -> List[int]:
+    """
+    Render each slide into an html fragment, stored as the `html` entry of data["slides"].
+
+    :param env: Jinja2 environment created by `make_environment`
+    :param pages: Pages that data["slides"] were created from
+    :param data: Template data of the whole deck
+    :param cache: Optional fragment cache, fragments found there are reused instead of rendered
+    :param deck: Result of `deck_key`, required when cache is given
+    :param jobs: Number of processes rendering slides, 0 for one per CPU
+    :return: Indices of slides that were rendered, i.e. not found in cache
+    """
+    slides = data["slides"]
+    keys = {}
+    rendered = []
+    for i, page in enumerate(pages):
+        entry = None
+        if cache is not None:
+            keys[i] = slide_key(page, i + 1, deck)
+            entry = cache.get(keys[i])
+        if entry is None or not replay_assets(entry[1]):
+            rendered.append(i)
+        else:
+            slides[i]["html"] = Markup(entry[0])
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs > 1 and len(rendered) > 1:
+        entries = _render_parallel(env, data, rendered, jobs)
+    else:
+        template = env.get_template("slide.html")
+        entries = (_render_slide(template, data, i) for i in rendered)
+
+    for i, entry in zip(rendered, entries):
+        if cache is not None:
+            cache.put(keys[i], entry)
+        slides[i]["html"] = Markup(entry[0])
+    return rendered
+
+
+def render_document(
+    document: Document,
+    template_dir,
+    cache: Optional[Union[BuildCache, MemoryCache]] = None,
+    jobs: int = 1,
+    vendor: Optional[Dict[str, str]] = None,
+) -> str:
+    """
+    Run jinja2 templating to create html of a parsed document.
+    template_dir may be a list of directories, searched in order.
+    Slides are rendered by jobs processes, see `render_slides`.
+    Libraries are loaded from the urls in vendor if given, from a CDN otherwise.
+    """
+    # Setup Jinja 2
+    bytecode_dir = cache.bytecode_dir if isinstance(cache, BuildCache) else None
+    env = make_environment(template_dir, bytecode_dir)
 
     template = env.get_template("index.html")
 
     # Fill template
-    pages = composite(document)
-    title = extract_title(document) or "Untitled"
-    slide_struct = retrieve_structure(pages)
-    _, options = parse_frontmatter(document)
-    width, height = options.computed_slide_size
+    width, height = document.options.computed_slide_size
 
     data = {
-        "title": title,
-        "struct": slide_struct,
+        "title": document.title or "Untitled",
+        "struct": document.struct,
         "slide_width": width,
         "slide_height": height,
+        "math": document.options.math,
+        "vendor": vendor,
         "slides": [
             {
                 "h1": page.h1,
@@ -85,29 +424,189 @@ def render_jinja2(document: str, template_dir) -> str:
                 "layout": page.option.layout,
                 "styles": page.option.styles,
             }
-            for page in pages
+            for page in document.pages
         ],
     }
+    deck = deck_key(env, data) if cache is not None else None
+    rendered = render_slides(env, document.pages, data, cache, deck, jobs)
+    document.fragments = [slide["html"] for slide in data["slides"]]
+    document.stats["slides_rendered"] = len(rendered)
 
     return template.render(data)
 
 
+def render_jinja2(
+    document: str,
+    template_dir,
+    cache: Optional[Union[BuildCache, MemoryCache]] = None,
+) -> str:
+    """Run jinja2 templating to create html"""
+    return render_document(parse_document(document), template_dir, cache)
+
+
+def render_deck(
+    document_path: str,
+    template_dir: str,
+    theme_dir: str = None,
+    cache: Optional[Union[BuildCache, MemoryCache]] = None,
+    document: Optional[Document] = None,
+    jobs: int = 1,
+    vendor: Optional[Dict[str, str]] = None,
+    max_highlight_lines: int = 0,
+) -> Document:
+    """
+    Render document without writing anything. The page is stored in `document.html`,
+    with urls of referenced files pointing to assets/<name>, and `document.assets` maps
+    each name to the file it stands for. See `build` for parameters.
+
+    :return: The rendered document
+    """
+    if document is None:
+        document = load_document(document_path)
+    resolver = PathResolver()
+    registry = AssetRegistry(
+        document_path,
+        resource_dir=document.options.resource_dir,
+        resolver=resolver,
+        url_prefix="assets",
+    )
+    renderer = None
+    if document.options.math == "mathml":
+        renderer = get_math_renderer(
+            cache.cache_dir if isinstance(cache, BuildCache) else None
+        )
+        hits, misses = renderer.hits, renderer.misses
+    elif document.options.math not in MATH_MODES:
+        raise ValueError(
+            f"Unknown math mode {document.options.math!r}, expected one of {MATH_MODES}"
+        )
+    highlights = highlight_cache.hits, highlight_cache.misses
+    with document.timed("render"), frozen_config(), asset_registry(
+        registry
+    ), math_renderer(renderer), highlight_cache_dir(
+        cache.cache_dir if isinstance(cache, BuildCache) else None
+    ), highlight_limit(
+        max_highlight_lines
+    ):
+        document.html = render_document(
+            document,
+            [theme_dir, template_dir] if theme_dir else template_dir,
+            cache,
+            jobs,
+            vendor,
+        )
+    document.assets = registry.assets
+    document.stats["assets"] = len(registry.assets)
+    document.stats["fs_probes"] = resolver.probes
+    document.stats["fs_probes_saved"] = resolver.probes_saved
+    document.stats["highlights_cached"] = highlight_cache.hits - highlights[0]
+    document.stats["highlights_rendered"] = highlight_cache.misses - highlights[1]
+    if renderer is not None:
+        document.stats["formulas_cached"] = renderer.hits - hits
+        document.stats["formulas_converted"] = renderer.misses - misses
+    return document
+
+
 def build(
-    document_path: str, output_dir: str, template_dir: str, theme_dir: str = None
-):
-    """Render document, create output directories and write result html."""
-    with open(document_path, encoding="utf8") as f:
-        document = f.read()
+    document_path: str,
+    output_dir: str,
+    template_dir: str,
+    theme_dir: str = None,
+    cache: Optional[Union[BuildCache, MemoryCache]] = None,
+    document: Optional[Document] = None,
+    asset_mode: str = "copy",
+    jobs: int = 1,
+    bundle: Optional[str] = None,
+    max_highlight_lines: int = 0,
+) -> Document:
+    """
+    Render document, create output directories and write result html.
+    Urls in the document are resolved while rendering, and the files they point to are
+    placed in the assets directory under names derived from their content.
+    If cache is given, rendered slides are stored there and reused by later builds.
+    A BuildCache is pruned to its size bound once the build is complete.
+
+    :param document: The document at document_path if already loaded, read from disk otherwise
+    :param asset_mode: How asset files are placed in the output directory, one of ASSET_MODES
+    :param jobs: Number of processes rendering slides, 0 for one per CPU
+    :param bundle: Make the deck work offline, one of BUNDLE_MODES. "directory" places the
+        libraries loaded from a CDN in output_dir/vendor, "single" writes index.html alone,
+        with everything inlined.
+    :param max_highlight_lines: Leave code blocks with more lines unhighlighted, 0 for no limit
+    :return: The built document, with timings of every stage
+    """
+    if bundle not in (None, *BUNDLE_MODES):
+        raise ValueError(
+            f"Unknown bundle mode {bundle!r}, expected one of {BUNDLE_MODES}"
+        )
+    if bundle == "single":
+        # Build a bundled directory, then inline it into one file
+        with tempfile.TemporaryDirectory() as build_dir:
+            document = build(
+                document_path,
+                build_dir,
+                template_dir,
+                theme_dir,
+                cache,
+                document,
+                "hardlink",
+                jobs,
+                bundle="directory",
+                max_highlight_lines=max_highlight_lines,
+            )
+            os.makedirs(output_dir, exist_ok=True)
+            with document.timed("inline"):
+                document.stats["files_inlined"] = inline_page(
+                    os.path.join(build_dir, "index.html"),
+                    os.path.join(output_dir, "index.html"),
+                )
+        return document
+    if document is None:
+        document = load_document(document_path)
+    if bundle:
+        # Fails before anything is written if libraries cannot be downloaded
+        with document.timed("bundle"):
+            vendored = vendor_files()
+            stylesheets = localize_stylesheets(merged_files(template_dir, theme_dir))
     asset_dir = os.path.join(output_dir, "assets")
 
-    merge_directories(template_dir, output_dir, theme_dir)
-    options = read_options(document_path)
-    output_html = render_jinja2(document, output_dir)
-    output_html = redirect_paths(
-        output_html, document_path=document_path, resource_dir=options.resource_dir
+    keep = ["index.html", "assets"]
+    if bundle:
+        # Localized stylesheets are written by bundle_directory, not copied
+        keep += ["vendor", *stylesheets]
+    with document.timed("templates"):
+        # index.html and assets are written below, the rest is copied from the templates
+        document.stats["template_files_written"] = sync_directories(
+            template_dir, output_dir, theme_dir, keep=keep
+        )
+    vendor = vendor_urls() if bundle else None
+    render_deck(
+        document_path,
+        template_dir,
+        theme_dir,
+        cache,
+        document,
+        jobs,
+        vendor,
+        max_highlight_lines,
     )
-    output_html = copy_assets(output_html, asset_dir).replace(asset_dir, "assets")
+    with document.timed("assets"):
+        document.stats["assets_written"] = place_assets(
+            document.assets, asset_dir, asset_mode
+        )
+        prune_directory(asset_dir, document.assets)
+
+    if bundle:
+        with document.timed("bundle"):
+            document.stats["bundle_files_written"] = bundle_directory(
+                output_dir, vendored, stylesheets, asset_mode
+            )
+
+    with document.timed("write"):
+        write_atomic(os.path.join(output_dir, "index.html"), document.html)
+
+    if isinstance(cache, BuildCache):
+        with document.timed("cache"):
+            document.stats["cache_entries_pruned"] = cache.prune()
 
-    output_file = os.path.join(output_dir, f"index.html")
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write(output_html)
+    return document
@@ -1,37 +1,250 @@
 from moffee import __version__
 import click
+import glob
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
-from moffee.builder import build, read_options
-from livereload import Server
+from typing import List, Optional, Tuple
+from moffee.builder import build, load_document, render_deck
+from moffee.live import LiveServer
+from moffee.utils.build_cache import CACHE_DIR_NAME, BuildCache, MemoryCache
+from moffee.utils.bundle import (
+    BUNDLE_MODES,
+    VENDOR_DIR_VARIABLE,
+    fetch_vendor,
+    vendor_cache_dir,
+)
+from moffee.utils.file_helper import ASSET_MODES
 import tempfile
 
 
-def run(md, output=None, live=False):
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "templates")
+
+
+def template_dirs(theme: str) -> Tuple[str, str]:
+    """Base and theme template directories of a theme"""
+    return os.path.join(TEMPLATE_DIR, "base"), os.path.join(TEMPLATE_DIR, theme)
+
+
+def file_cache(md) -> BuildCache:
+    """Fragment cache stored next to the markdown file"""
+    return BuildCache(
+        os.path.join(os.path.dirname(os.path.abspath(md)), CACHE_DIR_NAME)
+    )
+
+
+def prepare_bundle():
+    """Make sure the libraries of bundled decks are available before building any deck"""
+    try:
+        fetch_vendor()
+    except RuntimeError as e:
+        raise click.ClickException(str(e)) from e
+
+
+def run(
+    md,
+    output=None,
+    live=False,
+    cache=False,
+    asset_mode="copy",
+    jobs=1,
+    debounce=0.1,
+    bundle=None,
+    max_highlight_lines=0,
+):
     """Process the markdown file to render slides."""
+    if live:
+        run_live(md, debounce, max_highlight_lines)
+        return
+    if bundle:
+        prepare_bundle()
     if not output:
         output = tempfile.mkdtemp()
-    template_dir = os.path.join(os.path.dirname(__file__), "templates")
-    options = read_options(md)
-    base_template_dir = os.path.join(template_dir, "base")
-    theme_template_dir = os.path.join(template_dir, options.theme)
+    document = load_document(md)
+    base_template_dir, theme_template_dir = template_dirs(document.options.theme)
+    build(
+        md,
+        output,
+        base_template_dir,
+        theme_template_dir,
+        cache=file_cache(md) if cache else None,
+        document=document,
+        asset_mode=asset_mode,
+        jobs=jobs,
+        bundle=bundle,
+        max_highlight_lines=max_highlight_lines,
+    )
+    print(f"Generated html written to {os.path.join(output, 'index.html')}")
+
+
+def run_live(md, debounce=0.1, max_highlight_lines=0):
+    """Serve the slides of the markdown file from memory, updating them as files change."""
+    # Live mode keeps the previous build in memory and only re-renders changed slides
+    cache = MemoryCache()
+    document = load_document(md)
+    base_template_dir, theme_template_dir = template_dirs(document.options.theme)
     render_handler = partial(
-        build,
+        render_deck,
         document_path=md,
-        output_dir=output,
         template_dir=base_template_dir,
         theme_dir=theme_template_dir,
+        cache=cache,
+        max_highlight_lines=max_highlight_lines,
     )
 
-    render_handler()
-    print(f"Generated html written to {os.path.join(output, 'index.html')}")
-    if live:
-        server = Server()
-        server.watch(md, render_handler)
-        server.watch(base_template_dir, render_handler)
-        if theme_template_dir:
-            server.watch(theme_template_dir, render_handler)
-        server.serve(root=output)
+    render_handler(document=document)
+    cache.swap()
+
+    def live_handler():
+        document = render_handler()
+        print(f"Re-rendered {cache.misses} of {cache.hits + cache.misses} slides")
+        cache.swap()
+        return document
+
+    server = LiveServer(
+        live_handler,
+        base_template_dir,
+        theme_template_dir,
+        watch=[md],
+        delay=debounce,
+    )
+    server.serve(document)
+
+
+def find_documents(paths) -> List[str]:
+    """
+    Expand markdown files, directories (searched recursively) and glob patterns.
+
+    :param paths: Command line arguments
+    :return: Markdown files, each listed once, in argument order
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = glob.glob(os.path.join(path, "**", "*.md"), recursive=True)
+            # Skip hidden directories, such as caches and version control
+            matches = [
+                match
+                for match in matches
+                if not any(
+                    part.startswith(".")
+                    for part in os.path.relpath(match, path).split(os.sep)
+                )
+            ]
+        elif os.path.isfile(path):
+            matches = [path]
+        else:
+            matches = glob.glob(path, recursive=True)
+        found.extend(sorted(matches))
+    return list(dict.fromkeys(os.path.normpath(path) for path in found))
+
+
+def _contains(directory: str, path: str) -> bool:
+    """Whether path lies inside directory"""
+    return path.startswith(directory + os.sep)
+
+
+def deck_output_dirs(documents: List[str], output: str) -> List[str]:
+    """
+    Output directory of each deck, mirroring the layout of the markdown files.
+    A build owns its whole output directory, so no deck is written inside another's:
+    a deck whose directory would contain others, such as a.md next to a/b.md, is
+    written to a sibling directory <name>-deck instead.
+    """
+    paths = [os.path.abspath(md) for md in documents]
+    root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    dirs = [
+        os.path.join(output, os.path.splitext(os.path.relpath(path, root))[0])
+        for path in paths
+    ]
+
+    for i, directory in enumerate(dirs):
+        if not any(_contains(directory, other) for other in dirs):
+            continue
+        candidate, n = f"{directory}-deck", 1
+        while candidate in dirs or any(_contains(candidate, other) for other in dirs):
+            n += 1
+            candidate = f"{directory}-deck-{n}"
+        dirs[i] = candidate
+    return dirs
+
+
+def _build_deck(
+    md, output, cache, asset_mode, bundle=None, max_highlight_lines=0
+) -> Tuple[int, float, Optional[str]]:
+    """Build one deck of a batch, returns slide count, seconds and error message if it failed"""
+    start = time.perf_counter()
+    try:
+        document = load_document(md)
+        base_template_dir, theme_template_dir = template_dirs(document.options.theme)
+        build(
+            md,
+            output,
+            base_template_dir,
+            theme_template_dir,
+            cache=file_cache(md) if cache else None,
+            document=document,
+            asset_mode=asset_mode,
+            bundle=bundle,
+            max_highlight_lines=max_highlight_lines,
+        )
+    except Exception as e:
+        return 0, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+    return len(document.pages), time.perf_counter() - start, None
+
+
+def run_batch(
+    documents,
+    output=None,
+    cache=False,
+    asset_mode="copy",
+    jobs=1,
+    bundle=None,
+    max_highlight_lines=0,
+) -> int:
+    """
+    Build many decks, each into its own subdirectory of output, and print a summary.
+    Decks are distributed over jobs processes, which keep their markdown converters,
+    chunk caches and templates between decks.
+
+    :return: Number of decks that failed
+    """
+    if bundle:
+        prepare_bundle()
+    if not output:
+        output = tempfile.mkdtemp()
+    outputs = deck_output_dirs(documents, output)
+    jobs = min(jobs or os.cpu_count() or 1, len(documents))
+
+    start = time.perf_counter()
+    args = (
+        outputs,
+        [cache] * len(documents),
+        [asset_mode] * len(documents),
+        [bundle] * len(documents),
+        [max_highlight_lines] * len(documents),
+    )
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_build_deck, documents, *args))
+    else:
+        results = list(map(_build_deck, documents, *args))
+    elapsed = time.perf_counter() - start
+
+    width = max(len(md) for md in documents)
+    failed = 0
+    for md, deck_output, (slides, seconds, error) in zip(documents, outputs, results):
+        if error:
+            failed += 1
+            print(f"  {md:<{width}}  FAILED {error}")
+        else:
+            index = os.path.join(deck_output, "index.html")
+            print(f"  {md:<{width}}  {slides:>4} slides  {seconds:6.2f}s  {index}")
+    print(
+        f"Built {len(documents) - failed} of {len(documents)} decks in {elapsed:.2f}s"
+    )
+    return failed
 
 
 @click.group(
@@ -57,13 +270,18 @@ This command takes a markdown file as input and produces a set of slides
 formatted as an HTML file. You can specify an output directory where the
 HTML will be saved.
 
+Several files, directories or glob patterns build many decks at once, each
+into its own subdirectory of the output directory.
+
 Example usage:
 
 \b
   python moffee.py make example.md -o output/
+  python moffee.py make lectures/ "extra/*.md" -o output/ -j 0
+  python moffee.py make example.md -o output/ --bundle --bundle-mode single
 """
 )
-@click.argument("markdown", metavar="<markdown-file>")
+@click.argument("markdown", metavar="<markdown-file>...", nargs=-1, required=True)
 @click.option(
     "-o",
     "--output",
@@ -71,9 +289,81 @@ Example usage:
     default=None,
     help="Output file path. If not specified, a temporary directory will be used.",
 )
-def make(markdown, output):
+@click.option(
+    "--cache",
+    is_flag=True,
+    default=False,
+    help=f"Reuse slides rendered by previous builds, stored in {CACHE_DIR_NAME}/ next to the markdown file.",
+)
+@click.option(
+    "--asset-mode",
+    type=click.Choice(ASSET_MODES),
+    default="copy",
+    show_default=True,
+    help="How images and other files are placed in the output directory. "
+    "hardlink and reflink avoid copying large files, and fall back to copying where unsupported.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=0),
+    default=1,
+    show_default=True,
+    help="Number of processes rendering slides (or decks, when building many) in parallel, 0 for one per CPU.",
+)
+@click.option(
+    "--bundle",
+    is_flag=True,
+    default=False,
+    help="Make slides viewable offline, with libraries served from the output directory instead of a CDN.",
+)
+@click.option(
+    "--bundle-mode",
+    type=click.Choice(BUNDLE_MODES),
+    default=None,
+    help="How --bundle lays out the output: files next to index.html (directory, the default), "
+    "or one html file with everything inlined (single). Implies --bundle.",
+)
+@click.option(
+    "--max-highlight-lines",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    metavar="<lines>",
+    help="Leave longer code blocks unhighlighted, which saves time on large listings. "
+    "They are shown as plain code, and not highlighted later in the browser. 0 highlights all.",
+)
+def make(
+    markdown, output, cache, asset_mode, jobs, bundle, bundle_mode, max_highlight_lines
+):
     """Generate slides from a markdown file."""
-    run(markdown, output, live=False)
+    bundle = bundle_mode or ("directory" if bundle else None)
+    if len(markdown) == 1 and os.path.isfile(markdown[0]):
+        run(
+            markdown[0],
+            output,
+            live=False,
+            cache=cache,
+            asset_mode=asset_mode,
+            jobs=jobs,
+            bundle=bundle,
+            max_highlight_lines=max_highlight_lines,
+        )
+        return
+
+    documents = find_documents(markdown)
+    if not documents:
+        raise click.UsageError(f"No markdown files found in {', '.join(markdown)}")
+    if run_batch(
+        documents,
+        output,
+        cache=cache,
+        asset_mode=asset_mode,
+        jobs=jobs,
+        bundle=bundle,
+        max_highlight_lines=max_highlight_lines,
+    ):
+        raise SystemExit(1)
 
 
 @cli.command(
@@ -91,9 +381,51 @@ Example usage:
 """
 )
 @click.argument("markdown", metavar="<markdown-file>")
-def live(markdown):
+@click.option(
+    "--debounce",
+    type=click.IntRange(min=0),
+    default=100,
+    show_default=True,
+    metavar="<ms>",
+    help="Wait this long for further changes before rebuilding, so bursts of saves trigger one build.",
+)
+@click.option(
+    "--max-highlight-lines",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    metavar="<lines>",
+    help="Leave longer code blocks unhighlighted, so rebuilds stay fast while editing large listings. "
+    "They are shown as plain code, and not highlighted later in the browser. 0 highlights all.",
+)
+def live(markdown, debounce, max_highlight_lines):
     """Launch live mode to update html outputs."""
-    run(markdown, output=None, live=True)
+    run(
+        markdown,
+        output=None,
+        live=True,
+        debounce=debounce / 1000,
+        max_highlight_lines=max_highlight_lines,
+    )
+
+
+@cli.command(
+    help=f"""
+Download the libraries that --bundle places next to the slides.
+
+Bundled builds download missing libraries themselves. Run this while online
+to prepare a machine that builds offline. Files are kept in {vendor_cache_dir()},
+or in the directory set by {VENDOR_DIR_VARIABLE}.
+"""
+)
+@click.option("--force", is_flag=True, default=False, help="Download all files again.")
+def vendor(force):
+    """Download the libraries that --bundle places next to the slides."""
+    try:
+        fetched = fetch_vendor(force=force)
+    except RuntimeError as e:
+        raise click.ClickException(str(e)) from e
+    print(f"Downloaded {fetched} file(s) to {vendor_cache_dir()}")
 
 
 if __name__ == "__main__":
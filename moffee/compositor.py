@@ -1,24 +1,23 @@
-from typing import List
-from dataclasses import dataclass, field, fields
-from typing import List, Optional, Tuple, Dict, Any
-from copy import deepcopy
+from dataclasses import dataclass, field, fields, replace
+from functools import lru_cache
+from typing import Iterator, List, Sequence, Optional, Tuple, Dict, Any
 import yaml
 import re
-from moffee.utils.md_helper import (
-    get_header_level,
-    is_divider,
-    is_empty,
-    rm_comments,
-    contains_deco,
-)
+from moffee.utils.md_helper import rm_comments, classify_line, LineKind
 
 DEFAULT_ASPECT_RATIO = "16:9"
 DEFAULT_SLIDE_WIDTH = 720
 DEFAULT_SLIDE_HEIGHT = 405
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class PageOption:
+    """
+    Immutable options of a document or page. Options are shared between pages,
+    so derive new ones with `dataclasses.replace` instead of copying.
+    `styles` must be treated as read-only as well.
+    """
+
     default_h1: bool = False
     default_h2: bool = True
     default_h3: bool = True
@@ -28,6 +27,7 @@ class PageOption:
     slide_height: int = DEFAULT_SLIDE_HEIGHT
     layout: str = "content"
     resource_dir: str = "."
+    math: str = "browser"
     styles: dict = field(default_factory=dict)
 
     @property
@@ -60,6 +60,10 @@ class PageOption:
         return width, height
 
 
+_EMPTY_OR_DECO = (LineKind.BLANK, LineKind.COMMENT, LineKind.DECO)
+_OPTION_FIELDS = {f.name for f in fields(PageOption)} - {"styles"}
+
+
 class Direction:
     HORIZONTAL = "horizontal"
     VERTICAL = "vertical"
@@ -77,22 +81,30 @@ class Alignment:
     JUSTIFY = "justify"
 
 
-@dataclass
+# Paragraph chunks all share this instead of owning an empty list
+NO_CHILDREN: Tuple["Chunk", ...] = ()
+
+
+@dataclass(slots=True)
 class Chunk:
     paragraph: Optional[str] = None
-    children: Optional[List["Chunk"]] = field(default_factory=list)  # List of chunks
+    children: Sequence["Chunk"] = NO_CHILDREN  # List of chunks
     direction: Direction = Direction.HORIZONTAL
     type: Type = Type.PARAGRAPH
     alignment: Alignment = Alignment.LEFT
 
 
-@dataclass
+@dataclass(slots=True)
 class Page:
     raw_md: str
     option: PageOption
     h1: Optional[str] = None
     h2: Optional[str] = None
     h3: Optional[str] = None
+    _chunk: Optional[Chunk] = field(default=None, init=False, repr=False, compare=False)
+    _chunk_source: Optional[str] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     def __post_init__(self):
         self._preprocess()
@@ -112,7 +124,7 @@ class Page:
     @property
     def chunk(self) -> Chunk:
         """
-        Split raw_md into chunk tree
+        Chunk tree of raw_md, built on first access and rebuilt only after raw_md changes.
         Chunk tree branches when in-page divider is met.
         - adjacent "<->"s create chunk with horizontal direction
         - adjacent "===" create chunk with vertical direction
@@ -120,26 +132,35 @@ class Page:
 
         :return: Root of the chunk tree
         """
+        # Identity check keeps access O(1), any assignment to raw_md creates a new string object
+        if self._chunk is None or self._chunk_source is not self.raw_md:
+            self._chunk = self._split_chunks()
+            self._chunk_source = self.raw_md
+        return self._chunk
+
+    def _split_chunks(self) -> Chunk:
+        """Build the chunk tree in a single scan that tracks both divider kinds and fence state"""
+        # Lines of each vertical chunk, grouped by horizontal chunk
+        vgroups = [[[]]]
+        current_escaped = False
+        for line in self.raw_md.split("\n"):
+            kind = classify_line(line)
+            if kind == LineKind.FENCE:
+                current_escaped = not current_escaped
+            if not current_escaped and kind == LineKind.DIVIDER_VERTICAL:
+                vgroups.append([[]])
+            elif not current_escaped and kind == LineKind.DIVIDER_HORIZONTAL:
+                vgroups[-1].append([])
+            else:
+                vgroups[-1][-1].append(line + "\n")
 
-        def split_by_div(text, type) -> List[Chunk]:
-            strs = [""]
-            current_escaped = False
-            for line in text.split("\n"):
-                if line.strip().startswith("```"):
-                    current_escaped = not current_escaped
-                if is_divider(line, type) and not current_escaped:
-                    strs.append("\n")
-                else:
-                    strs[-1] += line + "\n"
-            return [Chunk(paragraph=s) for s in strs]
-
-        # collect "==="
-        vchunks = split_by_div(self.raw_md, "=")
-        # split by "<->" if possible
-        for i in range(len(vchunks)):
-            hchunks = split_by_div(vchunks[i].paragraph, "<")
+        vchunks = []
+        for hgroups in vgroups:
+            hchunks = [Chunk(paragraph="".join(lines)) for lines in hgroups]
             if len(hchunks) > 1:  # found <->
-                vchunks[i] = Chunk(children=hchunks, type=Type.NODE)
+                vchunks.append(Chunk(children=hchunks, type=Type.NODE))
+            else:
+                vchunks.append(hchunks[0])
 
         if len(vchunks) == 1:
             return vchunks[0]
@@ -156,16 +177,16 @@ class Page:
         """
 
         lines = self.raw_md.splitlines()
-        lines = [l for l in lines if not (1 <= get_header_level(l) <= 3)]
+        lines = [l for l in lines if not (1 <= classify_line(l) <= 3)]
         self.raw_md = "\n".join(lines).strip()
 
 
-def parse_frontmatter(document: str) -> Tuple[str, PageOption]:
+def split_frontmatter(document: str) -> Tuple[str, dict]:
     """
-    Parse the YAML front matter in a given markdown document.
+    Split the YAML front matter from a given markdown document.
 
     :param document: Input markdown document as a string.
-    :return: A tuple containing the document with front matter removed and the PageOption.
+    :return: A tuple containing the document with front matter removed and the parsed YAML data.
     """
     document = document.strip()
     front_matter = ""
@@ -184,60 +205,90 @@ def parse_frontmatter(document: str) -> Tuple[str, PageOption]:
     except yaml.YAMLError:
         yaml_data = {}
 
-    # Create PageOption from YAML data
-    option = PageOption()
-    for field in fields(option):
+    return content, yaml_data
+
+
+def make_option(yaml_data: dict) -> PageOption:
+    """
+    Create PageOption from front matter data. Unknown keys become styles.
+
+    :param yaml_data: Parsed YAML front matter
+    :return: The PageOption
+    """
+    yaml_data = dict(yaml_data)
+    kwargs = {}
+    for field in fields(PageOption):
         name = field.name
         if name in yaml_data:
-            setattr(option, name, yaml_data.pop(name))
-    option.styles = yaml_data
+            kwargs[name] = yaml_data.pop(name)
+    kwargs["styles"] = yaml_data
 
-    return content, option
+    return PageOption(**kwargs)
 
 
-def parse_deco(line: str, base_option: Optional[PageOption] = None) -> PageOption:
+def parse_frontmatter(document: str) -> Tuple[str, PageOption]:
     """
-    Parses a deco (custom decorator) line and returns a dictionary of key-value pairs.
-    If base_option is provided, it updates the option with matching keys from the deco. Otherwise initialize an option.
+    Parse the YAML front matter in a given markdown document.
 
-    :param line: The line containing the deco
-    :param base_option: Optional PageOption to update with deco values
-    :return: An updated PageOption
+    :param document: Input markdown document as a string.
+    :return: A tuple containing the document with front matter removed and the PageOption.
     """
+    content, yaml_data = split_frontmatter(document)
+    return content, make_option(yaml_data)
 
-    def parse_key_value_string(s: str) -> dict:
-        pattern = r'([\w-]+)\s*=\s*((?:"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|[^,]+))'
-        matches = re.findall(pattern, s)
 
-        result = {}
-        for key, value in matches:
-            if (value.startswith('"') and value.endswith('"')) or (
-                value.startswith("'") and value.endswith("'")
-            ):
-                value = value[1:-1].replace('\\"', '"').replace("\\'", "'")
-            result[key] = value.strip()
+@lru_cache(maxsize=1024)
+def parse_deco_items(line: str) -> Tuple[Tuple[str, Any], ...]:
+    """
+    Parses the key-value pairs of a deco (custom decorator) line. Results are memoized,
+    as decks tend to repeat the same decos.
 
-        return result
+    :param line: The line containing the deco
+    :return: Tuple of (key, parsed value) pairs
+    """
+    pattern = r'([\w-]+)\s*=\s*((?:"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|[^,]+))'
 
     deco_match = re.match(r"^\s*@\((.*?)\)\s*$", line)
     if not deco_match:
         raise ValueError(f"Input line should contain a deco, {line} received.")
 
-    deco_content = deco_match.group(1)
-    deco = parse_key_value_string(deco_content)
+    result = {}
+    for key, value in re.findall(pattern, deco_match.group(1)):
+        if (value.startswith('"') and value.endswith('"')) or (
+            value.startswith("'") and value.endswith("'")
+        ):
+            value = value[1:-1].replace('\\"', '"').replace("\\'", "'")
+        result[key] = parse_value(value.strip())
+
+    return tuple(result.items())
+
+
+def parse_deco(line: str, base_option: Optional[PageOption] = None) -> PageOption:
+    """
+    Parses a deco (custom decorator) line and returns the resulting PageOption.
+    If base_option is provided, it updates the option with matching keys from the deco. Otherwise initialize an option.
+    base_option is never modified, values the deco does not touch are shared with it.
 
+    :param line: The line containing the deco
+    :param base_option: Optional PageOption to update with deco values
+    :return: An updated PageOption
+    """
     if base_option is None:
         base_option = PageOption()
 
-    updated_option = deepcopy(base_option)
-
-    for key, value in deco.items():
-        if hasattr(updated_option, key):
-            setattr(updated_option, key, parse_value(value))
+    changes = {}
+    styles = {}
+    for key, value in parse_deco_items(line):
+        if key in _OPTION_FIELDS:
+            changes[key] = value
         else:
-            updated_option.styles[key] = parse_value(value)
+            styles[key] = value
 
-    return updated_option
+    if styles:
+        changes["styles"] = {**base_option.styles, **styles}
+    if not changes:
+        return base_option
+    return replace(base_option, **changes)
 
 
 def parse_value(value: str):
@@ -262,53 +313,136 @@ def composite(document: str) -> List[Page]:
     - "---" Divider (===, <->, +++ not count)
 
     :param document: Input markdown document as a string.
-    :param document_path: Optional string, will be used to redirect url in documents if given.
     :return: List of Page objects representing paginated slides
     """
-    pages: List[Page] = []
-    current_page_lines = []
-    current_escaped = False  # track whether in code area
-    current_h1 = current_h2 = current_h3 = None
-    prev_header_level = 0
+    return list(iter_pages(document))
 
-    document = rm_comments(document)
-    document, options = parse_frontmatter(document)
 
-    lines = document.split("\n")
+def paginate(document: str, options: PageOption) -> List[Page]:
+    """
+    Split a markdown document, whose comments and front matter are already removed, into slide pages.
+    See `composite` for splitting criteria.
 
-    def create_page():
-        nonlocal current_page_lines, current_h1, current_h2, current_h3, options
-        # Only make new page if has non empty lines
+    :param document: Document content as a string.
+    :param options: Document-level options parsed from the front matter.
+    :return: List of Page objects representing paginated slides
+    """
+    return list(iter_pages(document, options))
+
+
+def iter_line_spans(document: str) -> Iterator[Tuple[int, int]]:
+    """
+    Yield (start, end) offsets of every line in document, newline excluded.
+    Lines are found one at a time, so the document is never copied into a list of lines.
 
-        if all(l.strip() == "" for l in current_page_lines):
+    :param document: Input document as a string.
+    """
+    start = 0
+    while True:
+        end = document.find("\n", start)
+        if end == -1:
+            yield start, len(document)
             return
+        yield start, end
+        start = end + 1
 
-        raw_md = ""
-        local_option = deepcopy(options)
-        for line in current_page_lines:
-            if contains_deco(line):
-                local_option = parse_deco(line, local_option)
-            else:
-                raw_md += "\n" + line
-
-        page = Page(
-            raw_md=raw_md,
-            option=local_option,
-            h1=current_h1,
-            h2=current_h2,
-            h3=current_h3,
-        )
 
-        pages.append(page)
-        current_page_lines = []
+def iter_pages(document: str, options: Optional[PageOption] = None) -> Iterator[Page]:
+    """
+    Lazily composite a markdown document into slide pages, see `composite` for splitting criteria.
+    Runs in linear time, and each page is yielded with its final titles as soon as it closes.
+
+    :param document: Input markdown document as a string.
+    :param options: Document-level options. If given, document must already have comments
+                    and front matter removed. Otherwise they are removed and parsed here.
+    :return: Iterator of Page objects representing paginated slides
+    """
+    if options is None:
+        document = rm_comments(document)
+        document, options = parse_frontmatter(document)
+
+    # Current page is the slice document[page_start:page_end] without its deco lines
+    page_start = page_end = None
+    page_decos: List[Tuple[int, int]] = []
+    page_blank = True
+    current_escaped = False  # track whether in code area
+    current_h1 = current_h2 = current_h3 = None
+    prev_header_level = 0
+    env_h1 = env_h2 = env_h3 = None
+    interned_options: Dict[Tuple[str, ...], PageOption] = {(): options}
+
+    def create_page() -> Optional[Page]:
+        nonlocal page_start, page_end, page_decos, page_blank
+        nonlocal current_h1, current_h2, current_h3
+        # Only make new page if has non empty lines
+        if page_start is None or page_blank:
+            page = None
+        else:
+            runs = []
+            cursor = page_start
+            for start, end in page_decos:
+                if start > cursor:
+                    runs.append(document[cursor : start - 1])
+                cursor = end + 1
+            if cursor <= page_end:
+                runs.append(document[cursor:page_end])
+
+            # Pages without decos share the document options, identical deco sets share one instance
+            decos = tuple(document[start:end] for start, end in page_decos)
+            local_option = interned_options.get(decos)
+            if local_option is None:
+                local_option = options
+                for deco in decos:
+                    local_option = parse_deco(deco, local_option)
+                interned_options[decos] = local_option
+
+            page = Page(
+                raw_md="\n" + "\n".join(runs),
+                option=local_option,
+                h1=current_h1,
+                h2=current_h2,
+                h3=current_h3,
+            )
+
+        page_start = page_end = None
+        page_decos = []
+        page_blank = True
         current_h1 = current_h2 = current_h3 = None
+        return page
 
-    for _, line in enumerate(lines):
+    def choose_titles(page: Page) -> Page:
+        """Inherit titles from previous pages where needed"""
+        nonlocal env_h1, env_h2, env_h3
+        inherit_h1 = page.option.default_h1
+        inherit_h2 = page.option.default_h2
+        inherit_h3 = page.option.default_h3
+        if page.h1 is not None:
+            env_h1 = page.h1
+            env_h2 = env_h3 = None
+            inherit_h1 = inherit_h2 = inherit_h3 = False
+        if page.h2 is not None:
+            env_h2 = page.h2
+            env_h3 = None
+            inherit_h2 = inherit_h3 = False
+        if page.h3 is not None:
+            env_h3 = page.h3
+            inherit_h3 = False
+        if inherit_h1:
+            page.h1 = env_h1
+        if inherit_h2:
+            page.h2 = env_h2
+        if inherit_h3:
+            page.h3 = env_h3
+        return page
+
+    for start, end in iter_line_spans(document):
+        line = document[start:end]
+        kind = classify_line(line)
         # update current env stack
-        if line.strip().startswith("```"):
+        if kind == LineKind.FENCE:
             current_escaped = not current_escaped
 
-        header_level = get_header_level(line) if not current_escaped else 0
+        header_level = kind if kind <= 6 and not current_escaped else 0
 
         # Check if this is a new header and not consecutive
         # Only break at heading 1-3
@@ -318,13 +452,23 @@ def composite(document: str) -> List[Page]:
         is_more_than_level_4 = prev_header_level > header_level >= 3
         if header_level > 0 and is_downstep_header_level and not is_more_than_level_4:
             # Check if the next line is also a header
-            create_page()
-
-        if is_divider(line, type="-") and not current_escaped:
-            create_page()
+            page = create_page()
+            if page is not None:
+                yield choose_titles(page)
+
+        if kind == LineKind.DIVIDER_DASH and not current_escaped:
+            page = create_page()
+            if page is not None:
+                yield choose_titles(page)
             continue
 
-        current_page_lines.append(line)
+        if page_start is None:
+            page_start = start
+        page_end = end
+        if page_blank and kind != LineKind.BLANK:
+            page_blank = False
+        if kind == LineKind.DECO:
+            page_decos.append((start, end))
 
         if header_level == 1:
             current_h1 = line.lstrip("#").strip()
@@ -337,34 +481,10 @@ def composite(document: str) -> List[Page]:
 
         if header_level > 0:
             prev_header_level = header_level
-        if header_level == 0 and not is_empty(line) and not contains_deco(line):
+        if header_level == 0 and kind not in _EMPTY_OR_DECO:
             prev_header_level = 0
 
     # Create the last page if there's remaining content
-    create_page()
-
-    # Process each page and choose titles
-    env_h1 = env_h2 = env_h3 = None
-    for page in pages:
-        inherit_h1 = page.option.default_h1
-        inherit_h2 = page.option.default_h2
-        inherit_h3 = page.option.default_h3
-        if page.h1 is not None:
-            env_h1 = page.h1
-            env_h2 = env_h3 = None
-            inherit_h1 = inherit_h2 = inherit_h3 = False
-        if page.h2 is not None:
-            env_h2 = page.h2
-            env_h3 = None
-            inherit_h2 = inherit_h3 = False
-        if page.h3 is not None:
-            env_h3 = page.h3
-            inherit_h3 = False
-        if inherit_h1:
-            page.h1 = env_h1
-        if inherit_h2:
-            page.h2 = env_h2
-        if inherit_h3:
-            page.h3 = env_h3
-
-    return pages
+    page = create_page()
+    if page is not None:
+        yield choose_titles(page)
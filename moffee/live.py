@@ -0,0 +1,416 @@
+"""
+Live mode: rebuilds a deck whenever its files change, and pushes the slides that changed
+to open pages over server-sent events. The page swaps those slides in place (js/live.js)
+instead of reloading, so the view position and presentation mode are kept.
+Nothing is written to disk: the page is served from memory, and template files and
+assets are streamed from where they are.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from moffee.builder import Document
+from moffee.utils.file_helper import merged_files
+
+EVENTS_PATH = "/_moffee/events"
+CLIENT_SCRIPT = "js/live.js"
+
+# Seconds between keep-alive comments, which also detect closed connections
+_PING_INTERVAL = 15
+
+
+def split_page(html: str, fragments: List[str]) -> Optional[Tuple[str, ...]]:
+    """
+    Split a rendered page into the parts around its slide fragments.
+
+    :param html: The page
+    :param fragments: Html of each slide, in page order
+    :return: The len(fragments) + 1 parts between fragments, or None if a fragment is missing
+    """
+    parts = []
+    cursor = 0
+    for fragment in fragments:
+        start = html.find(fragment, cursor)
+        if start < 0:
+            return None
+        parts.append(html[cursor:start])
+        cursor = start + len(fragment)
+    parts.append(html[cursor:])
+    return tuple(parts)
+
+
+def diff_pages(old: Optional[Document], new: Document) -> dict:
+    """
+    Describe how to update a page showing old to show new.
+
+    :return: A "patch" event with the html of changed slides by index, or a "reload" event
+        if anything but slide contents changed
+    """
+    if old is None or len(old.fragments) != len(new.fragments):
+        return {"type": "reload"}
+    old_shell = split_page(old.html, old.fragments)
+    if old_shell is None or old_shell != split_page(new.html, new.fragments):
+        return {"type": "reload"}
+    changed = {
+        i: fragment
+        for i, (previous, fragment) in enumerate(zip(old.fragments, new.fragments))
+        if previous != fragment
+    }
+    return {"type": "patch", "slides": changed}
+
+
+class EventBroadcaster:
+    """Fans events out to every connected page, each with its own queue"""
+
+    def __init__(self):
+        self._clients = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def subscribe(self) -> queue.Queue:
+        client = queue.Queue()
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client: queue.Queue):
+        with self._lock:
+            self._clients.discard(client)
+
+    def publish(self, event: dict):
+        with self._lock:
+            for client in self._clients:
+                client.put(event)
+
+
+class FileWatcher(threading.Thread):
+    """Polls files and directories, calling callback once per round in which any of them changed"""
+
+    def __init__(
+        self,
+        paths: Callable[[], Iterable[str]],
+        callback: Callable[[], None],
+        interval: float = 0.25,
+    ):
+        super().__init__(daemon=True)
+        self.paths = paths
+        self.callback = callback
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._snapshot = self.snapshot()
+
+    def snapshot(self) -> Dict[str, Tuple[int, int]]:
+        """Size and modification time of every watched file"""
+        result = {}
+        for path in self.paths():
+            if os.path.isdir(path):
+                files = (
+                    os.path.join(dirpath, name)
+                    for dirpath, _, names in os.walk(path)
+                    for name in names
+                )
+            else:
+                files = [path]
+            for file in files:
+                try:
+                    stat = os.stat(file)
+                except OSError:
+                    continue
+                result[file] = (stat.st_size, stat.st_mtime_ns)
+        return result
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            snapshot = self.snapshot()
+            if snapshot != self._snapshot:
+                self._snapshot = snapshot
+                self.callback()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class RebuildScheduler:
+    """
+    Runs rebuilds on a worker thread, so that watching and serving never wait for a build.
+    Requests less than `delay` seconds apart are coalesced into one build. A build that is
+    superseded by requests made while it ran is dropped instead of published, unless results
+    have been dropped for `max_stale` seconds already, so continuous edits still show up.
+
+    :param build: Builds and returns the result
+    :param publish: Called with the result of each build that is not dropped
+    """
+
+    def __init__(
+        self,
+        build: Callable[[], Any],
+        publish: Callable[[Any], None],
+        delay: float = 0.1,
+        max_stale: float = 1.0,
+    ):
+        self.build = build
+        self.publish = publish
+        self.delay = delay
+        self.max_stale = max_stale
+        # Requests waiting for the next build
+        self.queue_depth = 0
+        # Requests coalesced into the latest build
+        self.coalesced = 0
+        self.last_duration: Optional[float] = None
+        self.builds = 0
+        self.dropped = 0
+        self._requested_at: Optional[float] = None
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def request(self):
+        """Ask for a rebuild, returns immediately"""
+        with self._condition:
+            self._requested_at = time.monotonic()
+            self.queue_depth += 1
+            self._condition.notify()
+
+    def _wait_for_request(self) -> bool:
+        """Wait until a request is `delay` seconds old, returns False once stopped"""
+        with self._condition:
+            while not self._stopped:
+                if self._requested_at is None:
+                    self._condition.wait()
+                    continue
+                remaining = self._requested_at + self.delay - time.monotonic()
+                if remaining <= 0:
+                    self.coalesced, self.queue_depth = self.queue_depth, 0
+                    self._requested_at = None
+                    return True
+                self._condition.wait(remaining)
+            return False
+
+    def _run(self):
+        stale_since = None
+        while self._wait_for_request():
+            start = time.perf_counter()
+            try:
+                result = self.build()
+            except Exception:
+                traceback.print_exc()
+                continue
+            finally:
+                self.last_duration = time.perf_counter() - start
+                self.builds += 1
+
+            with self._condition:
+                superseded = self._requested_at is not None
+            now = time.monotonic()
+            if superseded and (
+                stale_since is None or now - stale_since < self.max_stale
+            ):
+                stale_since = stale_since or now
+                self.dropped += 1
+                continue
+            stale_since = None
+            self.publish(result)
+
+
+class LiveHandler(SimpleHTTPRequestHandler):
+    """Serves the event stream, the page with the live client added, and files of the deck"""
+
+    # Set on subclasses created by `LiveServer.make_http_server`
+    state: "LiveServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == EVENTS_PATH:
+            self.send_events()
+        elif path in ("/", "/index.html"):
+            self.send_page()
+        else:
+            super().do_GET()
+
+    def translate_path(self, path: str) -> str:
+        # Unknown files map to an empty path, which is answered with 404
+        relpath = unquote(urlsplit(path).path).lstrip("/")
+        return self.state.source_path(relpath) or ""
+
+    def send_page(self):
+        build_id, html = self.state.page()
+        script = (
+            f"<script>window.moffeeBuild = {build_id};</script>\n"
+            f'<script src="{CLIENT_SCRIPT}"></script>\n'
+        )
+        end = html.rfind("</body>")
+        if end < 0:
+            end = len(html)
+        body = f"{html[:end]}{script}{html[end:]}".encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        client = self.state.events.subscribe()
+        try:
+            self.write_event({"type": "hello", "build": self.state.build_id})
+            while True:
+                try:
+                    event = client.get(timeout=_PING_INTERVAL)
+                except queue.Empty:
+                    self.wfile.write(b": ping\n\n")
+                    self.wfile.flush()
+                    continue
+                self.write_event(event)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.state.events.unsubscribe(client)
+
+    def write_event(self, event: dict):
+        data = json.dumps(event, ensure_ascii=False)
+        self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+
+class LiveServer:
+    """
+    Serves a deck rendered by `rebuild`, rebuilding it when a watched path changes.
+
+    :param rebuild: Renders the deck and returns the rendered Document, see `render_deck`
+    :param template_dir: Base template directory, providing static files such as css and js
+    :param theme_dir: Optional theme directory, overriding files of template_dir
+    :param watch: Files and directories whose changes trigger a rebuild, besides the templates
+    :param delay: Seconds to wait for further changes before rebuilding, see `RebuildScheduler`
+    """
+
+    def __init__(
+        self,
+        rebuild: Callable[[], Document],
+        template_dir: str,
+        theme_dir: Optional[str] = None,
+        watch: Iterable[str] = (),
+        host: str = "127.0.0.1",
+        port: int = 5500,
+        delay: float = 0.1,
+    ):
+        self.rebuild_handler = rebuild
+        self.template_dir = template_dir
+        self.theme_dir = theme_dir
+        self.watch = [*watch, template_dir, *([theme_dir] if theme_dir else [])]
+        self.host = host
+        self.port = port
+        self.events = EventBroadcaster()
+        self.document: Optional[Document] = None
+        self.build_id = 0
+        self._page = (0, "")
+        self._files: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.scheduler = RebuildScheduler(self.build, self.publish, delay=delay)
+
+    def page(self) -> Tuple[int, str]:
+        """Id and html of the latest build"""
+        return self._page
+
+    def source_path(self, relpath: str) -> Optional[str]:
+        """File served at relpath, either an asset or a template file"""
+        if relpath.startswith("assets/") and self.document is not None:
+            return self.document.assets.get(relpath[len("assets/") :])
+        return self._files.get(relpath)
+
+    def watched_paths(self) -> List[str]:
+        # Files referenced by the deck are watched too
+        assets = self.document.assets.values() if self.document else ()
+        return [*self.watch, *assets]
+
+    def update(self, document: Document) -> dict:
+        """Make document the latest build, and tell open pages how to show it"""
+        event = diff_pages(self.document, document)
+        self.document = document
+        self.build_id += 1
+        self._page = (self.build_id, document.html)
+        files = merged_files(self.template_dir, self.theme_dir)
+        # The page is rendered from index.html, slides from slide.html and layouts
+        self._files = {
+            relpath: path
+            for relpath, path in files.items()
+            if relpath not in ("index.html", "slide.html")
+            and not relpath.startswith("layouts/")
+        }
+        event["build"] = self.build_id
+        if event["type"] == "reload" or event["slides"]:
+            self.events.publish(event)
+        return event
+
+    def build(self) -> Document:
+        with self._lock:
+            return self.rebuild_handler()
+
+    def publish(self, document: Document):
+        self.update(document)
+        scheduler = self.scheduler
+        print(
+            f"Rebuilt in {scheduler.last_duration:.2f}s, {scheduler.coalesced} change(s) coalesced, "
+            f"{scheduler.dropped} superseded build(s) dropped so far"
+        )
+
+    def rebuild(self):
+        """Rebuild and publish right away, in the calling thread"""
+        try:
+            document = self.build()
+        except Exception:
+            traceback.print_exc()
+            return
+        self.update(document)
+
+    def make_http_server(self) -> ThreadingHTTPServer:
+        handler = type("BoundLiveHandler", (LiveHandler,), {"state": self})
+        httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        httpd.daemon_threads = True
+        return httpd
+
+    def serve(self, document: Optional[Document] = None):
+        """
+        Serve until interrupted.
+
+        :param document: The initial build, if already done
+        """
+        if document is None:
+            document = self.rebuild_handler()
+        self.update(document)
+
+        httpd = self.make_http_server()
+        watcher = FileWatcher(self.watched_paths, self.scheduler.request)
+        self.scheduler.start()
+        watcher.start()
+        print(f"Serving on http://{self.host}:{self.port}")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.stop()
+            self.scheduler.stop()
+            httpd.server_close()
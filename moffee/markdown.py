@@ -1,8 +1,20 @@
-from markdown import markdown
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from markdown import Markdown
 from markupsafe import Markup
 import pymdownx.superfences
+from moffee.utils.md_asset_ext import current_registry, record_assets, replay_assets
+from moffee.utils.md_highlight_ext import current_highlight_limit
+from moffee.utils.md_math_ext import current_math_renderer
 
 extensions = [
+    # Provides the highlighter of superfences and inlinehilite, so it is loaded first
+    "moffee.utils.md_highlight_ext",
     "pymdownx.tasklist",
     "pymdownx.extra",
     "pymdownx.caret",
@@ -18,6 +30,8 @@ extensions = [
     "wikilinks",
     "pymdownx.inlinehilite",
     "moffee.utils.md_obsidian_ext",
+    "moffee.utils.md_asset_ext",
+    "moffee.utils.md_math_ext",
 ]
 
 extension_configs = {
@@ -29,11 +43,147 @@ extension_configs = {
                 "format": pymdownx.superfences.fence_div_format,
             }
         ]
-    }
+    },
 }
 
+DEFAULT_CACHE_SIZE = 2048
+
+
+def _describe(obj) -> str:
+    """Stable description of non-JSON config values, such as fence formatters"""
+    name = getattr(obj, "__qualname__", None) or type(obj).__qualname__
+    return f"{getattr(obj, '__module__', '')}.{name}"
+
+
+def fingerprint() -> str:
+    """
+    Fingerprint of the current extension setup. Changes whenever `extensions`
+    or `extension_configs` are modified.
+
+    :return: Hex digest identifying the configuration
+    """
+    config = json.dumps(
+        [extensions, extension_configs], sort_keys=True, default=_describe
+    )
+    return hashlib.sha1(config.encode("utf8")).hexdigest()
+
+
+_fingerprint: ContextVar[Optional[str]] = ContextVar(
+    "moffee_config_fingerprint", default=None
+)
+
+
+def current_fingerprint() -> str:
+    """`fingerprint()` as fixed by the enclosing `frozen_config` block, computed now otherwise"""
+    return _fingerprint.get() or fingerprint()
+
+
+@contextmanager
+def frozen_config():
+    """
+    Compute `fingerprint()` once for all markdown converted inside the with-block, such as
+    a build. `extensions` and `extension_configs` must not be modified within it.
+    """
+    token = _fingerprint.set(fingerprint())
+    try:
+        yield _fingerprint.get()
+    finally:
+        _fingerprint.reset(token)
+
+
+class HTMLCache:
+    """
+    Least-recently-used cache of converted chunks, with hit/miss counters.
+    Entries are (html, asset records) pairs, see `md`.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: tuple):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def resize(self, maxsize: int):
+        """Change the size bound, evicting the least recently used entries. 0 disables caching."""
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > max(maxsize, 0):
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+
+cache = HTMLCache()
+
+# Loading extensions is far more expensive than converting a chunk, so every thread
+# keeps one configured Markdown instance and resets it between conversions.
+_pool = threading.local()
+
+
+def get_converter(config_fingerprint: str = None) -> Markdown:
+    """
+    Get the Markdown converter of the current thread, creating it on first use
+    or after the extension setup changed.
+
+    :param config_fingerprint: Optional precomputed result of `fingerprint()`
+    :return: A configured Markdown instance, reset and ready for conversion
+    """
+    config_fingerprint = config_fingerprint or current_fingerprint()
+    if getattr(_pool, "fingerprint", None) != config_fingerprint:
+        _pool.converter = Markdown(
+            extensions=extensions, extension_configs=extension_configs
+        )
+        _pool.fingerprint = config_fingerprint
+    return _pool.converter.reset()
+
 
 def md(text):
-    return Markup(
-        markdown(text, extensions=extensions, extension_configs=extension_configs)
+    """
+    Convert markdown text to html. Results are cached per chunk, together with the urls
+    resolved by the asset registry in effect, which are replayed on a cache hit.
+    Chunks are cached separately for each asset registry, math renderer and highlight limit.
+    """
+    config_fingerprint = current_fingerprint()
+    registry = current_registry()
+    renderer = current_math_renderer()
+    scope = (
+        (registry.fingerprint if registry is not None else "")
+        + (renderer.fingerprint if renderer is not None else "")
+        + f"{current_highlight_limit()}"
     )
+    key = hashlib.sha1(
+        f"{config_fingerprint}\0{scope}\0{text}".encode("utf8")
+    ).hexdigest()
+    entry = cache.get(key)
+    if entry is None or not replay_assets(entry[1]):
+        with record_assets() as records:
+            html = get_converter(config_fingerprint).convert(text)
+        entry = (html, tuple(records))
+        cache.put(key, entry)
+    return Markup(entry[0])
@@ -0,0 +1,84 @@
+// Live mode: applies slide updates pushed by `moffee live` without reloading the page.
+// Only loaded by the live server.
+(function () {
+    const VIEW_KEY = 'moffee-live-view';
+    let build = window.moffeeBuild;
+
+    function saveView() {
+        sessionStorage.setItem(VIEW_KEY, JSON.stringify({
+            x: window.scrollX,
+            y: window.scrollY,
+            presenting: isPresentationMode,
+            slide: currentSlide,
+        }));
+    }
+
+    function restoreView() {
+        const saved = sessionStorage.getItem(VIEW_KEY);
+        if (!saved) {
+            return;
+        }
+        sessionStorage.removeItem(VIEW_KEY);
+        const view = JSON.parse(saved);
+        if (view.presenting) {
+            currentSlide = Math.min(view.slide, slides.length - 1);
+            togglePresentationMode();
+        } else {
+            window.scrollTo(view.x, view.y);
+        }
+    }
+
+    function reload() {
+        saveView();
+        window.location.reload();
+    }
+
+    // Re-run renderers on the replaced slides only. main.js rescales slides whose content
+    // changes, including once formulas, diagrams and images are in place.
+    function typeset(containers) {
+        if (window.MathJax && MathJax.typesetPromise) {
+            MathJax.typesetClear(containers);
+            MathJax.typesetPromise(containers);
+        }
+        const diagrams = containers.flatMap(container => [...container.querySelectorAll('.mermaid')]);
+        if (window.mermaid && diagrams.length) {
+            mermaid.run({ nodes: diagrams });
+        }
+        if (window.triggerAutoScale) {
+            window.triggerAutoScale(containers);
+        }
+    }
+
+    function patch(changed) {
+        const containers = document.querySelectorAll('.slide-container');
+        const patched = [];
+        for (const [index, html] of Object.entries(changed)) {
+            const container = containers[Number(index)];
+            if (!container) {
+                reload();
+                return;
+            }
+            container.innerHTML = html;
+            patched.push(container);
+        }
+        typeset(patched);
+    }
+
+    const source = new EventSource('/_moffee/events');
+    source.onmessage = function (message) {
+        const event = JSON.parse(message.data);
+        if (event.type === 'hello') {
+            // Updates may have been missed before connecting, or while disconnected
+            if (event.build !== build) {
+                reload();
+            }
+        } else if (event.type === 'patch') {
+            build = event.build;
+            patch(event.slides);
+        } else if (event.type === 'reload') {
+            reload();
+        }
+    };
+
+    window.addEventListener('load', restoreView);
+})();
@@ -1,77 +1,161 @@
 // Automatic resizing to fit elements
 window.addEventListener('load', function () {
-    function autoScale() {
-        const elements = document.querySelectorAll('.auto-sizing');
+    // Scales are searched between MIN_SCALE and 1, to within SCALE_PRECISION
+    const MIN_SCALE = 0.05;
+    const SCALE_PRECISION = 0.005;
+    // Tolerance for sub-pixel rounding of scrollHeight and scrollWidth
+    const FIT_TOLERANCE = 1;
+    // Elements whose size changes may change how much room slide content needs
+    const MEDIA = 'img, svg, video, iframe, canvas, table, pre';
+
+    // .auto-sizing elements to rescale in the next frame
+    const pending = new Set();
+    let frameRequested = false;
+
+    function reset(element) {
+        element.style.transform = 'scale(1)';
+        element.style.width = 'auto';
+        element.style.height = 'auto';
+    }
+
+    function apply(element, scale, room) {
+        // Width is adjusted so that text is always full width
+        element.style.transform = `scale(${scale})`;
+        element.style.width = `${room.width / scale}px`;
+        element.style.height = `${room.height / scale}px`;
+    }
+
+    // Room the content of element may take up, read from the layout
+    function measure(element) {
+        const container = element.parentElement;
+        // Element may not align with container
+        const containerRect = container.getBoundingClientRect();
+        const contentRect = element.getBoundingClientRect();
+        // Consider padding
+        const style = window.getComputedStyle(container);
+        return {
+            width: container.clientWidth - parseFloat(style.paddingLeft) - parseFloat(style.paddingRight)
+                - (contentRect.left - containerRect.left),
+            height: container.clientHeight - parseFloat(style.paddingTop) - parseFloat(style.paddingBottom)
+                - (contentRect.top - containerRect.top),
+        };
+    }
+
+    function fits(element, scale, room) {
+        return element.scrollHeight * scale <= room.height + FIT_TOLERANCE
+            && element.scrollWidth * scale <= room.width + FIT_TOLERANCE;
+    }
+
+    function rescale() {
+        frameRequested = false;
+        const elements = [...pending].filter(element => element.isConnected);
+        pending.clear();
 
+        // All writes, then all reads, so that every pass costs a single layout
+        elements.forEach(reset);
+        let searches = [];
         elements.forEach(element => {
-            const container = element.parentElement;
-
-            // Reset transform for real dimensions
-            element.style.transform = 'scale(1)';
-            element.style.width = 'auto';
-            element.style.height = 'auto';
-
-            const contentHeight = element.scrollHeight;
-            const containerHeight = container.clientHeight;
-            const contentWidth = element.scrollWidth;
-            const containerWidth = container.clientWidth;
-
-            // Element may not align with container
-            const containerRect = container.getBoundingClientRect();
-            const contentRect = element.getBoundingClientRect();
-            const offsetX = contentRect.left - containerRect.left;
-            const offsetY = contentRect.top - containerRect.top;
-
-            // Consider padding
-            const computedStyle = window.getComputedStyle(container);
-            const paddingLeft = parseFloat(computedStyle.paddingLeft);
-            const paddingRight = parseFloat(computedStyle.paddingRight);
-            const paddingTop = parseFloat(computedStyle.paddingTop);
-            const paddingBottom = parseFloat(computedStyle.paddingBottom);
-
-            const availableWidth = containerWidth - paddingLeft - paddingRight - offsetX;
-            const availableHeight = containerHeight - paddingTop - paddingBottom - offsetY;
-
-            let scale = availableHeight / contentHeight;
-
-            // Width has to be adjusted so that text is always full width
-            if (scale < 1 || contentWidth > availableWidth) {
-                element.style.transform = `scale(${scale})`;
-                element.style.width = `${availableWidth / scale}px`;
-                element.style.height = `${availableHeight / scale}px`;
-                // Force refresh
-                document.body.offsetHeight;
+            const room = measure(element);
+            if (room.width <= 0 || room.height <= 0) {
+                return; // Hidden, rescaled once its container is laid out
+            }
+            if (fits(element, 1, room)) {
+                return;
             }
+            // Content gets taller as it gets narrower, so the largest scale that fits is
+            // found by bisection, starting from the scale that fits the unscaled height
+            const guess = Math.min(1, Math.max(MIN_SCALE, room.height / element.scrollHeight));
+            searches.push({ element, room, low: MIN_SCALE, high: 1, probe: guess });
+        });
 
-            // console.log(`Performed auto scale Scale=${scale.toFixed(2)}, scrollHeight=${(element.scrollHeight * scale).toFixed(2)}, containerHeight=${containerHeight.toFixed(2)}`);
-
-            // If somehow after resizing element significantly smaller than container
-            // resizes element by stepping through every scale value
-            if (element.scrollHeight * scale < 0.85 * containerHeight) {
-                step = 0.05 * (1 - scale)
-                scale = 1;
-                while (element.scrollHeight * scale >= containerHeight) {
-                    scale -= step;
-                    element.style.transform = `scale(${scale})`;
-                    element.style.width = `${availableWidth / scale}px`;
-                    // force dom size to be recalculated
-                    document.body.offsetHeight;
-                    // console.log(`Scale=${scale.toFixed(2)}, scrollHeight=${(element.scrollHeight * scale).toFixed(2)}, containerHeight=${containerHeight.toFixed(2)}`);
+        while (searches.length) {
+            searches.forEach(search => apply(search.element, search.probe, search.room));
+            searches.forEach(search => {
+                if (fits(search.element, search.probe, search.room)) {
+                    search.low = search.probe;
+                } else {
+                    search.high = search.probe;
                 }
-            }
+                search.probe = (search.low + search.high) / 2;
+            });
+            const done = searches.filter(search => search.high - search.low <= SCALE_PRECISION);
+            done.forEach(search => apply(search.element, search.low, search.room));
+            searches = searches.filter(search => search.high - search.low > SCALE_PRECISION);
+        }
+    }
 
+    function schedule(elements) {
+        elements.forEach(element => pending.add(element));
+        if (pending.size && !frameRequested) {
+            frameRequested = true;
+            requestAnimationFrame(rescale);
+        }
+    }
+
+    // .auto-sizing elements affected by a change of node
+    function autoSizingOf(node) {
+        const element = node.nodeType === Node.ELEMENT_NODE ? node : node.parentElement;
+        if (!element) {
+            return [];
+        }
+        const owner = element.closest('.auto-sizing');
+        return owner ? [owner] : [...element.querySelectorAll('.auto-sizing')];
+    }
+
+    // Containers change size when slides are shown, media when they load
+    const resizeObserver = new ResizeObserver(entries => {
+        schedule(entries.flatMap(entry => autoSizingOf(entry.target)));
+    });
+
+    function observe(root) {
+        root.querySelectorAll('.auto-sizing').forEach(element => {
+            resizeObserver.observe(element.parentElement);
+            element.querySelectorAll(MEDIA).forEach(media => resizeObserver.observe(media));
         });
     }
 
-    autoScale();
+    // Content replaced by MathJax, mermaid or live updates does not resize any observed
+    // element, as slide boxes have fixed sizes, so additions are watched separately
+    const mutationObserver = new MutationObserver(mutations => {
+        const changed = new Set();
+        mutations.forEach(mutation => {
+            autoSizingOf(mutation.target).forEach(element => changed.add(element));
+            mutation.addedNodes.forEach(node => {
+                if (node.nodeType === Node.ELEMENT_NODE) {
+                    autoSizingOf(node).forEach(element => changed.add(element));
+                    if (node.matches(MEDIA)) {
+                        resizeObserver.observe(node);
+                    }
+                    node.querySelectorAll(MEDIA).forEach(media => resizeObserver.observe(media));
+                    if (node.querySelector('.auto-sizing')) {
+                        observe(node);
+                    }
+                }
+            });
+            mutation.removedNodes.forEach(node => {
+                if (node.nodeType === Node.ELEMENT_NODE) {
+                    resizeObserver.unobserve(node);
+                    node.querySelectorAll('.content, ' + MEDIA).forEach(removed => resizeObserver.unobserve(removed));
+                }
+            });
+        });
+        schedule(changed);
+    });
+
+    // Rescale the given slides, or all of them
+    window.triggerAutoScale = function (containers) {
+        const roots = containers ? [...containers] : [document];
+        schedule(roots.flatMap(root => [...root.querySelectorAll('.auto-sizing')]));
+    };
 
-    // update
-    // window.addEventListener('resize', autoScale);
-    document.querySelectorAll('img').forEach(img => {
-        img.addEventListener('load', autoScale);
+    // Observing reports the initial size of every visible slide, which scales them
+    observe(document);
+    document.querySelectorAll('.slide-container').forEach(slide => {
+        mutationObserver.observe(slide, { childList: true, subtree: true });
     });
-    // setInterval(autoScale, 1000);
-    window.triggerAutoScale = autoScale;
+    if (document.fonts.status === 'loading') {
+        document.fonts.ready.then(() => window.triggerAutoScale());
+    }
 });
 
 
@@ -133,7 +217,7 @@ function showSlide(index) {
     } else {
         currentSlide = index
         slides[currentSlide].classList.add('active');
-        window.triggerAutoScale();
+        window.triggerAutoScale([slides[currentSlide]]);
     }
 }
 
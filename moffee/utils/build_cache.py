@@ -0,0 +1,146 @@
+"""
+Caches of rendered slide fragments, used to skip unchanged slides between builds.
+Entries are (html, asset records) pairs, the records let a build register the assets
+of a reused fragment, see `AssetRegistry.replay`.
+The on-disk cache is bounded in size, see `BuildCache.prune`.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Optional, Tuple
+
+CACHE_DIR_NAME = ".moffee-cache"
+
+# Bytes of entries kept by a BuildCache, covering slides and the formula and highlight caches
+DEFAULT_MAX_SIZE = 256 << 20
+
+
+def hash_key(*parts) -> str:
+    """
+    Hash arbitrary JSON-serializable parts into a cache key.
+
+    :param parts: Values the cached content depends on
+    :return: Hex digest
+    """
+    serialized = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf8")).hexdigest()
+
+
+class BuildCache:
+    """
+    Stores each slide fragment as a JSON file under cache_dir, named by its key.
+    Formulas and highlighted code are cached in the same directory, and all entries are
+    bounded together by `prune`. Reading an entry marks it as recently used.
+
+    :param max_size: Bytes of entries kept by `prune`
+    """
+
+    def __init__(self, cache_dir: str, max_size: int = DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def bytecode_dir(self) -> str:
+        """Directory of compiled Jinja2 templates"""
+        return os.path.join(self.cache_dir, "jinja")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, "slides", key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Tuple[str, list]]:
+        try:
+            with open(self._path(key), encoding="utf8") as f:
+                entry = json.load(f)
+            html, records = entry["html"], entry["assets"]
+            touch(self._path(key))
+        except (OSError, ValueError, KeyError, TypeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return html, records
+
+    def put(self, key: str, entry: Tuple[str, list]):
+        html, records = entry
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file first so that an interrupted build never leaves a truncated entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf8") as f:
+            json.dump({"html": html, "assets": list(records)}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def prune(self) -> int:
+        """
+        Remove the least recently used entries until all entries fit in max_size bytes.
+        Compiled templates are left alone, Jinja2 manages them.
+
+        :return: Number of entries removed
+        """
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            if dirpath == self.cache_dir:
+                dirnames[:] = [name for name in dirnames if name != "jinja"]
+            for name in filenames:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat_result = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat_result.st_mtime_ns, stat_result.st_size, path))
+
+        removed = 0
+        size = 0
+        for _, entry_size, path in sorted(entries, reverse=True):
+            size += entry_size
+            if size <= self.max_size:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue  # Pruned by a concurrent build
+            removed += 1
+        return removed
+
+
+def touch(path: str):
+    """Mark a cache entry as recently used, so that `BuildCache.prune` keeps it longer"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+class MemoryCache:
+    """
+    Keeps the fragments of the latest build in memory, for live mode.
+    Slides whose key is unchanged since the previous build are spliced in instead of rendered.
+    Call `swap()` once a build is complete to drop fragments of slides that no longer exist.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._previous = {}
+        self._current = {}
+
+    def get(self, key: str) -> Optional[Tuple[str, list]]:
+        entry = self._current.get(key) or self._previous.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._current[key] = entry
+        return entry
+
+    def put(self, key: str, entry: Tuple[str, list]):
+        self._current[key] = entry
+
+    def swap(self):
+        self._previous, self._current = self._current, {}
+        self.hits = self.misses = 0
@@ -0,0 +1,334 @@
+"""
+Offline bundles: decks that load nothing from the network when viewed.
+The libraries pages normally load from a CDN are vendored into the output directory, or
+everything is inlined into a single html file. Vendored files come from a local cache,
+filled once with `moffee vendor` (or on the first bundled build) and reused afterwards.
+"""
+
+import base64
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import urllib.request
+from html import escape
+from typing import Dict, IO, Optional
+from urllib.parse import unquote, urlparse
+from moffee.utils.file_helper import (
+    URL_ATTRIBUTES,
+    attribute_span,
+    create_temp_file,
+    iter_start_tags,
+    open_atomic,
+    place_asset,
+    write_atomic,
+)
+
+# How a deck is bundled: files next to index.html, or one self-contained html file
+BUNDLE_MODES = ("directory", "single")
+
+VENDOR_DIR_NAME = "vendor"
+
+# Environment variable overriding where vendored files are cached
+VENDOR_DIR_VARIABLE = "MOFFEE_VENDOR_DIR"
+
+_CDN = "https://cdn.jsdelivr.net/npm"
+
+_ICONS = [
+    "exclamation-diamond-fill",
+    "exclamation-triangle-fill",
+    "info-circle-fill",
+    "justify",
+    "lightning-fill",
+    "pen-fill",
+    "pencil-fill",
+    "question-circle-fill",
+    "star-fill",
+    "x-circle-fill",
+]
+
+# Vendored files by path under the vendor directory, with the url they are fetched from.
+# Versions are pinned so bundles do not change under a cache. mermaid and MathJax come
+# as single-file builds, which need no further requests: the UMD build of mermaid instead
+# of its ES module chunks, and the SVG output of MathJax, which embeds its fonts.
+VENDOR_FILES: Dict[str, str] = {
+    "bootstrap.min.css": f"{_CDN}/bootstrap@5.3.3/dist/css/bootstrap.min.css",
+    "mermaid.min.js": f"{_CDN}/mermaid@10.9.1/dist/mermaid.min.js",
+    "tex-svg.js": f"{_CDN}/mathjax@3.2.2/es5/tex-svg.js",
+    **{
+        f"icons/{icon}.svg": f"{_CDN}/bootstrap-icons@1.11.0/icons/{icon}.svg"
+        for icon in _ICONS
+    },
+}
+
+# Vendored libraries by template name, see `vendor_urls`
+VENDOR_LIBRARIES = {
+    "bootstrap": "bootstrap.min.css",
+    "mermaid": "mermaid.min.js",
+    "mathjax": "tex-svg.js",
+}
+
+# Files shipped inside the moffee package, if a distribution includes them
+PACKAGE_VENDOR_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "vendor")
+
+_CSS_URL_PATTERN = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+# Multiple of 3, so that base64 blocks concatenate without padding in between
+_ENCODE_BLOCK_SIZE = 3 << 16
+_COPY_BLOCK_SIZE = 1 << 16
+
+
+def vendor_cache_dir() -> str:
+    """Directory vendored files are downloaded to"""
+    directory = os.environ.get(VENDOR_DIR_VARIABLE)
+    if directory:
+        return directory
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "moffee", VENDOR_DIR_NAME)
+
+
+def find_vendor_file(relpath: str) -> Optional[str]:
+    """Path of a vendored file in the download cache or the package, None if missing"""
+    for directory in (vendor_cache_dir(), PACKAGE_VENDOR_DIR):
+        path = os.path.join(directory, *relpath.split("/"))
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def fetch_vendor(force: bool = False) -> int:
+    """
+    Download vendored files missing from the cache.
+
+    :param force: Download all files again
+    :return: Number of files downloaded
+    """
+    fetched = 0
+    for relpath, url in VENDOR_FILES.items():
+        if not force and find_vendor_file(relpath):
+            continue
+        target = os.path.join(vendor_cache_dir(), *relpath.split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = create_temp_file(os.path.dirname(target))
+        try:
+            with os.fdopen(fd, "wb") as f, urllib.request.urlopen(url) as response:
+                shutil.copyfileobj(response, f)
+            os.replace(tmp_path, target)
+        except OSError as e:
+            os.remove(tmp_path)
+            raise RuntimeError(
+                f"Cannot download {url} for bundling ({e}). Run `moffee vendor` while online, "
+                f"or place the file at {target}"
+            ) from e
+        fetched += 1
+    return fetched
+
+
+def vendor_files() -> Dict[str, str]:
+    """
+    Paths of all vendored files, downloading missing ones first.
+    Raises RuntimeError if a file is missing and cannot be downloaded.
+
+    :return: Path by path under the vendor directory
+    """
+    fetch_vendor()
+    return {relpath: find_vendor_file(relpath) for relpath in VENDOR_FILES}
+
+
+def vendor_urls() -> Dict[str, str]:
+    """Urls of vendored libraries relative to index.html, by template name"""
+    return {
+        name: f"{VENDOR_DIR_NAME}/{relpath}"
+        for name, relpath in VENDOR_LIBRARIES.items()
+    }
+
+
+def localize_stylesheets(files: Dict[str, str]) -> Dict[str, str]:
+    """
+    Stylesheets that load vendored files from the CDN, with their urls pointing to the
+    vendor directory instead.
+
+    :param files: Source path by path relative to the output directory, see `merged_files`
+    :return: Localized content by relative path, for stylesheets that load vendored files
+    """
+    local = {url: relpath for relpath, url in VENDOR_FILES.items()}
+    localized = {}
+    for relpath, source in files.items():
+        if not relpath.endswith(".css"):
+            continue
+        base = posixpath.dirname(relpath) or "."
+
+        def replace(match):
+            vendored = local.get(match.group(2))
+            if vendored is None:
+                return match.group(0)
+            target = posixpath.relpath(f"{VENDOR_DIR_NAME}/{vendored}", base)
+            return f"url('{target}')"
+
+        with open(source, encoding="utf8") as f:
+            css = f.read()
+        result = _CSS_URL_PATTERN.sub(replace, css)
+        if result != css:
+            localized[relpath] = result
+    return localized
+
+
+def bundle_directory(
+    output_dir: str,
+    files: Dict[str, str],
+    stylesheets: Dict[str, str],
+    mode: str = "copy",
+) -> int:
+    """
+    Make a built deck independent of the network: place vendored files in
+    output_dir/vendor, and write stylesheets pointing at them instead of the CDN.
+    Only files that changed are written, atomically.
+
+    :param files: Result of `vendor_files`, resolved before the build writes anything
+    :param stylesheets: Result of `localize_stylesheets` for the templates of the deck
+    :param mode: How vendored files are placed, one of ASSET_MODES
+    :return: Number of files written
+    """
+    written = 0
+    vendor_dir = os.path.join(output_dir, VENDOR_DIR_NAME)
+    for relpath, source in files.items():
+        target = os.path.join(vendor_dir, *relpath.split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        written += place_asset(source, target, mode)
+
+    for relpath, css in stylesheets.items():
+        target = os.path.join(output_dir, *relpath.split("/"))
+        try:
+            with open(target, encoding="utf8") as f:
+                if f.read() == css:
+                    continue
+        except (OSError, ValueError):
+            pass
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        write_atomic(target, css)
+        written += 1
+    return written
+
+
+def _local_path(url: str, base_dir: str) -> Optional[str]:
+    """File a relative url points to, None for remote urls, data urls or missing files"""
+    parsed = urlparse(url)
+    if parsed.scheme or parsed.netloc or not parsed.path:
+        return None
+    path = os.path.join(base_dir, unquote(parsed.path))
+    return path if os.path.isfile(path) else None
+
+
+def _mime_type(path: str) -> str:
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def _write_data_url(out: IO[str], path: str):
+    """Write the content of a file as a data url, encoding it block by block"""
+    out.write(f"data:{_mime_type(path)};base64,")
+    with open(path, "rb") as f:
+        while block := f.read(_ENCODE_BLOCK_SIZE):
+            out.write(base64.b64encode(block).decode("ascii"))
+
+
+def _write_stylesheet(out: IO[str], path: str):
+    """Write a stylesheet with the files its urls point to inlined"""
+    with open(path, encoding="utf8") as f:
+        css = f.read()
+    cursor = 0
+    for match in _CSS_URL_PATTERN.finditer(css):
+        source = _local_path(match.group(2), os.path.dirname(path))
+        if source is None:
+            continue
+        out.write(css[cursor : match.start()].replace("</style", "<\\/style"))
+        out.write('url("')
+        _write_data_url(out, source)
+        out.write('")')
+        cursor = match.end()
+    out.write(css[cursor:].replace("</style", "<\\/style"))
+
+
+def _write_script(out: IO[str], path: str):
+    """Write a script, escaping the end tags it may contain across block boundaries"""
+    carry = ""
+    with open(path, encoding="utf8") as f:
+        while block := f.read(_COPY_BLOCK_SIZE):
+            text = (carry + block).replace("</script", "<\\/script")
+            # Keep a tail that may hold the start of an end tag
+            carry = text[-8:]
+            out.write(text[:-8])
+    out.write(carry)
+
+
+def _inline_tag(out: IO[str], raw: str, tag: str, attrs: dict, base_dir: str) -> int:
+    """Write a start tag with the local files it references inlined, returns their number"""
+    rel = (attrs.get("rel") or "").lower().split()
+    if tag == "link" and "stylesheet" in rel:
+        source = _local_path(attrs.get("href") or "", base_dir)
+        if source is None:
+            out.write(raw)
+            return 0
+        out.write("<style>")
+        _write_stylesheet(out, source)
+        out.write("</style>")
+        return 1
+
+    if tag == "script":
+        source = _local_path(attrs.get("src") or "", base_dir)
+        if source is None:
+            out.write(raw)
+            return 0
+        kept = "".join(
+            f' {name}="{escape(value, quote=True)}"' if value else f" {name}"
+            for name, value in attrs.items()
+            if name != "src"
+        )
+        # The end tag of the script follows in the page
+        out.write(f"<script{kept}>")
+        _write_script(out, source)
+        return 1
+
+    inlined = 0
+    cursor = 0
+    for attr in URL_ATTRIBUTES[tag]:
+        source = _local_path(attrs.get(attr) or "", base_dir)
+        span = attribute_span(raw, attr) if source else None
+        if span is None:
+            continue
+        out.write(raw[cursor : span[0]])
+        out.write('"')
+        _write_data_url(out, source)
+        out.write('"')
+        cursor = span[1]
+        inlined += 1
+    out.write(raw[cursor:])
+    return inlined
+
+
+def inline_page(page_path: str, output_path: str) -> int:
+    """
+    Write a single html file with everything page_path references locally inlined:
+    stylesheets and scripts as elements, images and other files as data urls.
+    The result is streamed to output_path, so files are never held in memory encoded.
+
+    :param page_path: The page, whose relative urls are resolved against its directory
+    :param output_path: The html file to write
+    :return: Number of files inlined
+    """
+    base_dir = os.path.dirname(os.path.abspath(page_path))
+    with open(page_path, encoding="utf8") as f:
+        page = f.read()
+
+    # Links are left alone, the files they point to are not part of the page
+    tags = [tag for tag in URL_ATTRIBUTES if tag != "a"]
+    inlined = 0
+    cursor = 0
+    with open_atomic(output_path) as out:
+        for start, raw, tag, attrs in iter_start_tags(page, tags):
+            out.write(page[cursor:start])
+            inlined += _inline_tag(out, raw, tag, dict(attrs), base_dir)
+            cursor = start + len(raw)
+        out.write(page[cursor:])
+    return inlined
@@ -1,126 +1,638 @@
 import os
 import re
 import shutil
+import stat
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from functools import cached_property
+from html import escape
+from html.parser import HTMLParser
 from urllib.parse import urlparse
 from pathlib import Path
-import uuid
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from bs4 import BeautifulSoup
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Tags and attributes that reference asset files
+ASSET_ATTRIBUTES = {
+    "img": ("src",),
+    "link": ("href",),
+    "script": ("src",),
+    "a": ("href",),
+    "video": ("src", "poster"),
+    "audio": ("src",),
+    "source": ("src",),
+    "track": ("src",),
+}
+
+# Tags and attributes that hold urls
+URL_ATTRIBUTES = {
+    **ASSET_ATTRIBUTES,
+    "iframe": ("src",),
+    "embed": ("src",),
+    "object": ("data",),
+}
+
+
+_ATTRIBUTE_PATTERN = re.compile(
+    r"""([^\s"'>/=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'=<>`]+))?"""
+)
+_FEED_SIZE = 1 << 16
+
+# How asset files are placed in the output directory
+ASSET_MODES = ("copy", "hardlink", "reflink")
+
+_HASH_BLOCK_SIZE = 1 << 20
+# FICLONE ioctl request, clones a file on copy-on-write filesystems (btrfs, xfs)
+_FICLONE = 0x40049409
+# Content digests keyed by (path, size, mtime, inode), kept across builds of a live session
+_digests: Dict[Tuple[str, int, int, int], str] = {}
 
 
 def merge_directories(base_dir: str, output_dir: str, merge_dir: str = None):
-    """Merge base_dir and merge_dir into output_dir, merge_dir overwrites base_dir if confliction happens"""
-    # Clear the output_dir before writing the merged files
-    if os.path.exists(output_dir):
-        shutil.rmtree(output_dir)
-    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    """
+    Merge base_dir and merge_dir into output_dir, merge_dir overwrites base_dir if confliction happens.
+    Anything else in output_dir is removed, see `sync_directories`.
+    """
+    sync_directories(base_dir, output_dir, merge_dir)
+
+
+def _walk_files(root: str) -> Dict[str, str]:
+    """Map relative path to absolute path of every file below root"""
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            files[os.path.relpath(path, root)] = path
+    return files
+
+
+def _same_file(source: str, target: str, compare: str) -> bool:
+    try:
+        source_stat, target_stat = os.stat(source), os.stat(target)
+    except OSError:
+        return False
+    if not stat.S_ISREG(target_stat.st_mode):
+        return False
+    if source_stat.st_size != target_stat.st_size:
+        return False
+    if compare == "hash":
+        return file_digest(source, source_stat) == file_digest(target, target_stat)
+    # Copies keep the modification time of their source
+    return source_stat.st_mtime_ns == target_stat.st_mtime_ns
+
+
+def merged_files(base_dir: str, merge_dir: str = None) -> Dict[str, str]:
+    """
+    Files of the merge of base_dir and merge_dir, as `merge_directories` would write them.
 
-    shutil.copytree(base_dir, output_dir, dirs_exist_ok=True)
+    :return: Source path by path relative to the merged directory, using "/" as separator
+    """
+    files = _walk_files(base_dir)
+    if merge_dir:
+        files.update(_walk_files(merge_dir))
+    return {relpath.replace(os.sep, "/"): path for relpath, path in files.items()}
+
+
+def sync_directories(
+    base_dir: str,
+    output_dir: str,
+    merge_dir: str = None,
+    keep: Iterable[str] = (),
+    compare: str = "mtime",
+) -> int:
+    """
+    Make output_dir the merge of base_dir and merge_dir like `merge_directories`, but only write
+    files that changed and remove stale ones, instead of recreating output_dir.
+
+    :param base_dir: Directory to merge
+    :param output_dir: Directory to update
+    :param merge_dir: Optional directory overwriting base_dir if confliction happens
+    :param keep: Top level names or relative paths (using "/" as separator) in output_dir that are
+        written by someone else, neither copied nor removed
+    :param compare: Compare files by "mtime" (size and modification time) or "hash" (content)
+    :return: Number of files written
+    """
+    if compare not in ("mtime", "hash"):
+        raise ValueError(f"Unknown comparison {compare!r}, expected 'mtime' or 'hash'")
+    keep = set(keep)
+
+    def owned(relpath):
+        return (
+            relpath.split(os.sep, 1)[0] not in keep
+            and relpath.replace(os.sep, "/") not in keep
+        )
+
+    sources = _walk_files(base_dir)
     if merge_dir:
-        shutil.copytree(
-            merge_dir, output_dir, dirs_exist_ok=True, copy_function=shutil.copy2
+        sources.update(_walk_files(merge_dir))
+    sources = {relpath: path for relpath, path in sources.items() if owned(relpath)}
+
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    for relpath, path in _walk_files(output_dir).items():
+        if owned(relpath) and relpath not in sources:
+            os.remove(path)
+
+    written = 0
+    for relpath, source in sources.items():
+        target = os.path.join(output_dir, relpath)
+        if _same_file(source, target, compare):
+            continue
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copy2(source, tmp_path)
+            os.replace(tmp_path, target)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        written += 1
+
+    # Remove directories left empty by stale files
+    for dirpath, dirnames, filenames in os.walk(output_dir, topdown=False):
+        relpath = os.path.relpath(dirpath, output_dir)
+        if dirpath != output_dir and owned(relpath) and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+    return written
+
+
+def create_temp_file(directory: str, suffix: str = ".tmp") -> Tuple[int, str]:
+    """
+    Create a new file with a random name in directory, like tempfile.mkstemp.
+    Unlike mkstemp, which makes the file private, it gets the permissions of a plain open()
+    as the umask allows, so that it can replace a published file.
+
+    :return: File descriptor open for writing, and path of the file
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+    while True:
+        path = os.path.join(directory, f"tmp{os.urandom(8).hex()}{suffix}")
+        try:
+            return os.open(path, flags, 0o666), path
+        except FileExistsError:
+            continue
+
+
+@contextmanager
+def open_atomic(path: str):
+    """
+    Open a text file for writing through a temp file, which replaces path once the with-block
+    completes, so readers never see it half-written or missing.
+    """
+    fd, tmp_path = create_temp_file(os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write_atomic(path: str, content: str):
+    """Write a text file through a temp file, see `open_atomic`"""
+    with open_atomic(path) as f:
+        f.write(content)
+
+
+class _StartTagScanner(HTMLParser):
+    """Records position, raw text and attributes of start tags in `tags`"""
+
+    def __init__(self, tags):
+        super().__init__(convert_charrefs=False)
+        self.tags = tags
+        self.found = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.tags:
+            self.found.append((self.getpos(), self.get_starttag_text(), tag, attrs))
+
+
+def attribute_span(raw: str, attr: str) -> Optional[Tuple[int, int]]:
+    """Start and end of the value of attr in the raw text of a start tag, quotes included"""
+    # Skip the tag name, the first attribute-like token
+    matches = _ATTRIBUTE_PATTERN.finditer(raw, 1)
+    next(matches, None)
+    for match in matches:
+        if match.group(1).lower() == attr and match.group(2) is not None:
+            return match.span(2)
+    return None
+
+
+def _rewrite_tag(raw: str, attr: str, value: str) -> str:
+    """Replace the value of attr in the raw text of a start tag"""
+    span = attribute_span(raw, attr)
+    if span is None:
+        return raw
+    start, end = span
+    return f'{raw[:start]}"{escape(value, quote=True)}"{raw[end:]}'
+
+
+def iter_start_tags(
+    document: str, tags: Iterable[str]
+) -> Iterator[Tuple[int, str, str, List[Tuple[str, Optional[str]]]]]:
+    """
+    Find start tags of an HTML document, parsing it incrementally.
+
+    :param document: HTML document to scan
+    :param tags: Names of the tags to find
+    :return: Iterator of (offset, raw text, tag name, attributes) of each tag, in document order
+    """
+    scanner = _StartTagScanner(set(tags))
+    line_starts = [0]
+    line_starts.extend(m.end() for m in re.finditer("\n", document))
+
+    def flush():
+        for (lineno, offset), raw, tag, attrs in scanner.found:
+            yield line_starts[lineno - 1] + offset, raw, tag, attrs
+        scanner.found.clear()
+
+    for i in range(0, len(document), _FEED_SIZE):
+        scanner.feed(document[i : i + _FEED_SIZE])
+        yield from flush()
+    scanner.close()
+    yield from flush()
+
+
+def iter_rewrite_attributes(
+    document: str,
+    tag_attrs: Dict[str, Tuple[str, ...]],
+    rewrite: Callable[[str, str, str], Optional[str]],
+) -> Iterator[str]:
+    """
+    Rewrite attribute values of an HTML document without re-serializing it.
+    The document is parsed incrementally, and pieces of the result are yielded as soon as
+    they are known. Everything but the rewritten attribute values is passed through unchanged.
+
+    :param document: HTML document to process
+    :param tag_attrs: Attributes to rewrite, keyed by tag name
+    :param rewrite: Called with (tag, attribute, value), returns the new value or None to keep it
+    :return: Iterator of document pieces
+    """
+    cursor = 0
+    for start, raw, tag, attrs in iter_start_tags(document, tag_attrs):
+        new_raw = raw
+        for attr, value in attrs:
+            if attr in tag_attrs[tag] and value is not None:
+                new_value = rewrite(tag, attr, value)
+                if new_value is not None and new_value != value:
+                    new_raw = _rewrite_tag(new_raw, attr, new_value)
+        if new_raw is not raw:
+            yield document[cursor:start]
+            yield new_raw
+            cursor = start + len(raw)
+    yield document[cursor:]
+
+
+def rewrite_attributes(
+    document: str,
+    tag_attrs: Dict[str, Tuple[str, ...]],
+    rewrite: Callable[[str, str, str], Optional[str]],
+) -> str:
+    """Rewrite attribute values of an HTML document, see `iter_rewrite_attributes`"""
+    return "".join(iter_rewrite_attributes(document, tag_attrs, rewrite))
+
+
+class PathResolver:
+    """
+    Resolves relative urls of a document to absolute paths, see `redirect_paths`.
+    Resolutions and filesystem probes are cached for the lifetime of the resolver, usually one build.
+    `probes` counts filesystem probes performed, `probes_saved` those answered from cache.
+    """
+
+    def __init__(self):
+        self.probes = 0
+        self.probes_saved = 0
+        self._stats: Dict[str, Optional[os.stat_result]] = {}
+        self._resolved: Dict[Tuple[str, str, str], Tuple[Optional[str], int]] = {}
+
+    def stat(self, path: str) -> Optional[os.stat_result]:
+        """Cached os.stat, None if path does not exist"""
+        if path in self._stats:
+            self.probes_saved += 1
+            return self._stats[path]
+        self.probes += 1
+        try:
+            result = os.stat(path)
+        except (OSError, ValueError):
+            result = None
+        self._stats[path] = result
+        return result
+
+    def exists(self, path: str) -> bool:
+        """Cached os.path.exists"""
+        return self.stat(path) is not None
+
+    def isfile(self, path: str) -> bool:
+        """Cached os.path.isfile"""
+        result = self.stat(path)
+        return result is not None and stat.S_ISREG(result.st_mode)
+
+    def resolve(
+        self, url: str, document_path: str, resource_dir: str = "."
+    ) -> Optional[str]:
+        """
+        Find the absolute path of a relative url.
+
+        :param url: Url to resolve
+        :param document_path: Path to the document the url appears in
+        :param resource_dir: Optional resource path
+        :return: The absolute path, or None if url is absolute already or cannot be resolved
+        """
+        document_dir = os.path.dirname(document_path)
+        key = (url, document_dir, resource_dir)
+        if key in self._resolved:
+            resolved, probes = self._resolved[key]
+            self.probes_saved += probes
+            return resolved
+
+        probes_before = self.probes + self.probes_saved
+        resolved = self._resolve(url, document_dir, resource_dir)
+        self._resolved[key] = (
+            resolved,
+            self.probes + self.probes_saved - probes_before,
         )
+        return resolved
+
+    def _resolve(self, url, document_dir, resource_dir) -> Optional[str]:
+        parsed = urlparse(url)
+        if not url or parsed.netloc or parsed.scheme or url.startswith("#"):
+            return None
+        if os.path.isabs(url) and self.exists(url):
+            return None
+
+        # Try different base paths to make the URL absolute
+        base_paths = [
+            document_dir,
+            os.path.abspath(resource_dir),
+            os.path.join(document_dir, resource_dir),
+        ]
+
+        for base in base_paths:
+            absolute_url = os.path.abspath(os.path.normpath(os.path.join(base, url)))
+            if self.exists(absolute_url):
+                return absolute_url
 
+        return None
 
-def redirect_paths(document: str, document_path: str, resource_dir: str = ".") -> str:
+
+def redirect_paths(
+    document: str,
+    document_path: str,
+    resource_dir: str = ".",
+    resolver: Optional[PathResolver] = None,
+) -> str:
     """
-    Redirect all relative paths in a document to absolute paths with some guessing.
+    Redirect all relative paths in url attributes of an HTML document to absolute paths with some guessing.
     Following possible base paths will be tried:
     - The original path itself maybe a valid absolute url (Absolute path or http)
     - The direct parent dir of the document
     - The resource dir (if it exists as an absolute path)
     - The resource dir relative to the document (Otherwise)
 
-    :param document: Markdown document string
+    :param document: HTML document string
     :param document_path: Path to the document
     :param resource_dir: Optional resource path
+    :param resolver: Optional resolver, to share cached results across calls
     :return: Document string with all urls redirected.
     """
+    registry = AssetRegistry(document_path, resource_dir, resolver)
+    return rewrite_attributes(
+        document, URL_ATTRIBUTES, lambda tag, attr, url: registry.resolve(url)
+    )
 
-    def is_absolute_url(url):
-        return bool(urlparse(url).netloc) or (
-            os.path.isabs(url) and os.path.exists(url)
-        )
-
-    def make_absolute(base, relative):
-        return os.path.abspath(os.path.normpath(os.path.join(base, relative)))
 
-    def replace_url(match):
-        url = match.group(1)
-        if is_absolute_url(url):
-            return match.group(0)
+def file_digest(path: str, stat_result: Optional[os.stat_result] = None) -> str:
+    """
+    Hash the content of a file. Results are reused until the file is modified.
 
-        # Try different base paths to make the URL absolute
-        base_paths = [
-            os.path.dirname(document_path),
-            os.path.abspath(resource_dir),
-            os.path.join(os.path.dirname(document_path), resource_dir),
-        ]
+    :param path: Path to the file
+    :param stat_result: Optional result of os.stat(path), if known already
+    :return: Hex digest of the content
+    """
+    path = os.path.abspath(path)
+    if stat_result is None:
+        stat_result = os.stat(path)
+    key = (path, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+    digest = _digests.get(key)
+    if digest is None:
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+                hasher.update(block)
+        digest = _digests[key] = hasher.hexdigest()
+    return digest
 
-        for base in base_paths:
-            absolute_url = make_absolute(base, url)
-            if os.path.exists(absolute_url) or is_absolute_url(absolute_url):
-                return match.group(0).replace(url, absolute_url)
 
-        return match.group(0)
+def asset_name(path: str, stat_result: Optional[os.stat_result] = None) -> str:
+    """
+    Name of the file at path in the output asset directory, derived from its content.
+    Identical files share one name, and a name never refers to different content.
+    """
+    _, ext = os.path.splitext(path)
+    return f"{file_digest(path, stat_result)[:16]}{ext.lower()}"
 
-    # Regular expression to find markdown links
-    # import ipdb; ipdb.set_trace(context=15)
-    url_pattern = re.compile(r'"(.+?)"')
 
-    # Substitute all URLs in the document using the replace_url function
-    redirected_document = url_pattern.sub(replace_url, document)
+def _reflink(source: str, target: str):
+    """Clone source to target without copying data, raises OSError if unsupported"""
+    if fcntl is None:
+        raise OSError("reflink is not supported on this platform")
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
 
-    return redirected_document
 
+def place_asset(source: str, target: str, mode: str = "copy") -> bool:
+    """
+    Place a content-named asset in the output directory.
+    Nothing is done if target exists, since its name implies the same content.
+    Hardlinks and reflinks avoid copying large files, and fall back to a copy where the
+    filesystem does not support them. Files are never visible half-written.
 
-def copy_assets(document: str, target_dir: str) -> str:
+    :param source: Path to the source file
+    :param target: Path to place the asset at
+    :param mode: One of ASSET_MODES
+    :return: True if a file was written
     """
-    Copy all asset resources in an HTML document to target_dir, then update URLs to target_dir/uuid_originalname.ext
+    if mode not in ASSET_MODES:
+        raise ValueError(f"Unknown asset mode {mode!r}, expected one of {ASSET_MODES}")
+    if os.path.exists(target):
+        return False
 
-    :param document: HTML document to process
-    :param target_dir: Target directory
-    :return: Updated document with URLs redirected
+    if mode == "hardlink":
+        try:
+            os.link(source, target)
+            return True
+        except FileExistsError:
+            return False
+        except OSError:
+            pass  # Other device or filesystem without links
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+    os.close(fd)
+    try:
+        if mode == "reflink":
+            try:
+                _reflink(source, tmp_path)
+                shutil.copystat(source, tmp_path)
+            except OSError:
+                shutil.copy2(source, tmp_path)
+        else:
+            shutil.copy2(source, tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return True
+
+
+class AssetRegistry:
+    """
+    Decides the final url of every url a document references, and collects the files to copy
+    to the output asset directory.
+    Urls are resolved relative to the document like in `redirect_paths`. Files referenced by
+    `ASSET_ATTRIBUTES` become `url_prefix/asset_name(path)`, other resolved paths become absolute.
     """
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
 
-    soup = BeautifulSoup(document, "html.parser")
+    def __init__(
+        self,
+        document_path: str,
+        resource_dir: str = ".",
+        resolver: Optional[PathResolver] = None,
+        url_prefix: str = "assets",
+    ):
+        self.document_path = document_path
+        self.resource_dir = resource_dir
+        self.resolver = resolver or PathResolver()
+        self.url_prefix = url_prefix
+        # Asset name to source path
+        self.assets: Dict[str, str] = {}
+        self._recorders: List[list] = []
 
-    # Dictionary to store original path to new path mapping
-    path_mapping = {}
+    @cached_property
+    def fingerprint(self) -> str:
+        """Identifies how urls are resolved, i.e. everything but the filesystem state"""
+        scope = [
+            os.path.abspath(os.path.dirname(self.document_path)),
+            self.resource_dir,
+            os.path.abspath(self.resource_dir),
+            self.url_prefix,
+        ]
+        return hashlib.sha1("\0".join(scope).encode("utf8")).hexdigest()
+
+    def url_for(self, tag: str, url: str) -> Optional[str]:
+        """
+        Resolve url, registering the file it points to as an asset.
+
+        :param tag: Name of the tag holding url
+        :param url: Url as written in the document
+        :return: The final url, or None to keep url unchanged
+        """
+        result = self._url_for(tag, url)
+        for records in self._recorders:
+            records.append((tag, url, result))
+        return result
+
+    def resolve(self, url: str) -> Optional[str]:
+        """Absolute path url points to, None for remote urls and missing files"""
+        path = self.resolver.resolve(url, self.document_path, self.resource_dir)
+        if path is None and os.path.isabs(url) and self.resolver.exists(url):
+            return url
+        return path
 
-    # Tags and attributes to check for URLs
-    tag_attr_pairs = [
-        ("img", "src"),
-        ("link", "href"),
-        ("script", "src"),
-        ("a", "href"),
-    ]
+    def _url_for(self, tag: str, url: str) -> Optional[str]:
+        path = self.resolve(url)
+        if path is None:
+            return None
+        if tag not in ASSET_ATTRIBUTES or not self.resolver.isfile(path):
+            return path
 
-    for tag, attr in tag_attr_pairs:
-        for element in soup.find_all(tag):
-            if element.has_attr(attr):
-                original_path = element[attr]
+        name = asset_name(path, self.resolver.stat(path))
+        self.assets[name] = path
+        return f"{self.url_prefix}/{name}"
 
-                # Skip if it's an external URL or a non-file path
-                if urlparse(original_path).scheme or not os.path.isfile(original_path):
-                    continue
+    @contextmanager
+    def record(self):
+        """Collect the (tag, url, result) triples of all url_for calls made inside the with-block"""
+        records = []
+        self._recorders.append(records)
+        try:
+            yield records
+        finally:
+            self._recorders.pop()
 
-                if original_path not in path_mapping:
-                    # Generate a new filename
-                    original_filename = os.path.basename(original_path)
-                    name, ext = os.path.splitext(original_filename)
-                    new_filename = f"{str(uuid.uuid4())[:8]}_{name}{ext}"
-                    new_path = os.path.join(target_dir, new_filename)
+    def replay(self, records) -> bool:
+        """
+        Resolve recorded urls again, registering their assets. Used for html taken from a cache.
 
-                    # Copy the file
-                    shutil.copy2(original_path, new_path)
+        :param records: (tag, url, result) triples collected by `record`
+        :return: False if any url resolves differently now, i.e. the cached html is stale
+        """
+        return all(self.url_for(tag, url) == result for tag, url, result in records)
 
-                    # Store the mapping
-                    path_mapping[original_path] = new_path
+    def copy_to(self, target_dir: str, mode: str = "copy") -> int:
+        """Place all registered assets in target_dir, see `place_assets`"""
+        return place_assets(self.assets, target_dir, mode)
+
+    def prune(self, target_dir: str) -> int:
+        """Remove files of target_dir that are not registered assets, i.e. left by earlier builds"""
+        return prune_directory(target_dir, self.assets)
+
+
+def place_assets(assets: Dict[str, str], target_dir: str, mode: str = "copy") -> int:
+    """
+    Place assets in target_dir, see `place_asset`.
+
+    :param assets: Source path by asset name
+    :return: Number of files written, assets present from earlier builds are skipped
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    return sum(
+        place_asset(path, os.path.join(target_dir, name), mode)
+        for name, path in assets.items()
+    )
+
+
+def prune_directory(target_dir: str, keep: Iterable[str]) -> int:
+    """
+    Remove files of target_dir whose name is not in keep.
+
+    :return: Number of files removed
+    """
+    keep = set(keep)
+    removed = 0
+    for entry in os.scandir(target_dir):
+        if entry.is_file() and entry.name not in keep:
+            os.remove(entry.path)
+            removed += 1
+    return removed
+
+
+def copy_assets(document: str, target_dir: str, mode: str = "copy") -> str:
+    """
+    Copy all asset resources in an HTML document to target_dir, then update URLs to target_dir/name,
+    where name is derived from the content of the file, see `asset_name`.
+
+    :param document: HTML document to process
+    :param target_dir: Target directory
+    :param mode: How files are placed in target_dir, one of ASSET_MODES
+    :return: Updated document with URLs redirected
+    """
+    # Urls are file paths already, relative ones to the working directory
+    registry = AssetRegistry(os.path.join(os.getcwd(), ""), url_prefix=target_dir)
 
-                # Update the attribute with the new path
-                element[attr] = path_mapping[original_path]
+    def copy(tag, attr, original_path):
+        # Skip if it's an external URL or a non-file path
+        if urlparse(original_path).scheme or not os.path.isfile(original_path):
+            return None
+        return registry.url_for(tag, original_path)
 
-    return str(soup)
+    document = rewrite_attributes(document, ASSET_ATTRIBUTES, copy)
+    registry.copy_to(target_dir, mode)
+    return document
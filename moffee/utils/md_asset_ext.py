@@ -0,0 +1,90 @@
+"""
+Rewrites urls of images, links and embedded html to their final location while markdown is converted,
+so that the rendered html never needs to be scanned again.
+Urls are only rewritten inside an `asset_registry` block.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+import xml.etree.ElementTree as etree
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+from moffee.utils.file_helper import AssetRegistry, URL_ATTRIBUTES, rewrite_attributes
+
+_registry: ContextVar[Optional[AssetRegistry]] = ContextVar(
+    "moffee_asset_registry", default=None
+)
+
+
+def current_registry() -> Optional[AssetRegistry]:
+    """The registry of the enclosing `asset_registry` block, if any"""
+    return _registry.get()
+
+
+@contextmanager
+def asset_registry(registry: AssetRegistry):
+    """Resolve urls with registry for all markdown converted inside the with-block"""
+    token = _registry.set(registry)
+    try:
+        yield registry
+    finally:
+        _registry.reset(token)
+
+
+@contextmanager
+def record_assets():
+    """Collect the urls resolved inside the with-block, see `AssetRegistry.record`"""
+    registry = current_registry()
+    if registry is None:
+        yield []
+        return
+    with registry.record() as records:
+        yield records
+
+
+def replay_assets(records) -> bool:
+    """Register the assets of cached html again, see `AssetRegistry.replay`"""
+    registry = current_registry()
+    return registry is None or registry.replay(records)
+
+
+class AssetExtension(Extension):
+    """Asset extension for Python-Markdown."""
+
+    def extendMarkdown(self, md):
+        """Add AssetTreeprocessor to Markdown instance."""
+        md.registerExtension(self)
+
+        # Run after "unescape" so that urls are final
+        md.treeprocessors.register(AssetTreeprocessor(md), "moffee_assets", -10)
+
+
+class AssetTreeprocessor(Treeprocessor):
+
+    def run(self, root: etree.Element) -> None:
+        registry = current_registry()
+        if registry is None:
+            return
+
+        for element in root.iter():
+            for attr in URL_ATTRIBUTES.get(element.tag, ()):
+                url = element.get(attr)
+                if url is not None:
+                    new_url = registry.url_for(element.tag, url)
+                    if new_url is not None:
+                        element.set(attr, new_url)
+
+        # Raw html is kept aside by the parser until serialization
+        stash = self.md.htmlStash.rawHtmlBlocks
+        for i, block in enumerate(stash):
+            if isinstance(block, str):
+                stash[i] = rewrite_attributes(
+                    block,
+                    URL_ATTRIBUTES,
+                    lambda tag, attr, url: registry.url_for(tag, url),
+                )
+
+
+def makeExtension(**kwargs):  # pragma: no cover
+    return AssetExtension(**kwargs)
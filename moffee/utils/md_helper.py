@@ -4,6 +4,84 @@ import re
 from typing import Optional
 
 
+class LineKind:
+    """
+    Kind codes returned by `classify_line`. Codes 1-6 are header levels.
+    """
+
+    TEXT = 0
+    BLANK = 7
+    COMMENT = 8
+    FENCE = 9
+    DECO = 10
+    DIVIDER_DASH = 11  # ---
+    DIVIDER_STAR = 12  # ***
+    DIVIDER_UNDERSCORE = 13  # ___
+    DIVIDER_VERTICAL = 14  # ===
+    DIVIDER_HORIZONTAL = 15  # <->
+
+
+_LINE_PATTERN = re.compile(
+    r"(?P<header>#{1,6})\s"
+    r"|\s*(?:"
+    r"(?P<fence>```)"
+    r"|(?P<dash>-{3,})\s*$"
+    r"|(?P<star>\*{3,})\s*$"
+    r"|(?P<underscore>_{3,})\s*$"
+    r"|(?P<equal>={3,})\s*$"
+    r"|(?P<arrow><->)\s*$"
+    r"|(?P<deco>@\(.*?\))\s*$"
+    r"|(?P<comment><!--.*-->)\s*$"
+    r"|(?P<blank>)$"
+    r")"
+)
+
+_GROUP_KINDS = {
+    "fence": LineKind.FENCE,
+    "dash": LineKind.DIVIDER_DASH,
+    "star": LineKind.DIVIDER_STAR,
+    "underscore": LineKind.DIVIDER_UNDERSCORE,
+    "equal": LineKind.DIVIDER_VERTICAL,
+    "arrow": LineKind.DIVIDER_HORIZONTAL,
+    "deco": LineKind.DECO,
+    "comment": LineKind.COMMENT,
+    "blank": LineKind.BLANK,
+}
+
+
+def classify_line(line: str) -> int:
+    """
+    Classifies a line with a single precompiled regex match.
+    Headers follow `get_header_level`, fences are lines starting with ``` after stripping,
+    dividers follow `is_divider` with the matching type, decos `contains_deco`, and
+    BLANK or COMMENT lines are those `is_empty` accepts.
+
+    :param line: The line to classify, without newline
+    :return: A LineKind code, header level (1-6) for headers
+    """
+    match = _LINE_PATTERN.match(line)
+    if match is None:
+        return LineKind.TEXT
+    group = match.lastgroup
+    if group == "header":
+        return len(match.group(group))
+    return _GROUP_KINDS[group]
+
+
+_COMMENT_PATTERN = re.compile(r"^\s*<!--.*-->\s*$")
+_HEADER_PATTERN = re.compile(r"^(#{1,6})\s")
+_IMAGE_PATTERN = re.compile(r"!\[.*?\]\(.*?\)")
+_DECO_PATTERN = re.compile(r"^\s*@\(.*?\)\s*$")
+_DIVIDER_PATTERNS = {
+    None: re.compile(r"^\s*([\*\-\_]{3,}|<->|={3,})\s*$"),
+    "*": re.compile(r"^\s*\*{3,}\s*$"),
+    "-": re.compile(r"^\s*\-{3,}\s*$"),
+    "_": re.compile(r"^\s*_{3,}\s*$"),
+    "<": re.compile(r"^\s*<->\s*$"),
+    "=": re.compile(r"^\s*={3,}\s*$"),
+}
+
+
 def is_comment(line: str) -> bool:
     """
     Determines if a given line is a Markdown comment.
@@ -12,7 +90,7 @@ def is_comment(line: str) -> bool:
     :param line: The line to check
     :return: True if the line is a comment, False otherwise
     """
-    return bool(re.match(r"^\s*<!--.*-->\s*$", line))
+    return bool(_COMMENT_PATTERN.match(line))
 
 
 def get_header_level(line: str) -> int:
@@ -22,7 +100,7 @@ def get_header_level(line: str) -> int:
     :param line: The line to check
     :return: The header level (1-6) if it's a header, 0 otherwise
     """
-    match = re.match(r"^(#{1,6})\s", line)
+    match = _HEADER_PATTERN.match(line)
     if match:
         return len(match.group(1))
     else:
@@ -49,21 +127,10 @@ def is_divider(line: str, type: Optional[str] = None) -> bool:
                  Defaults to None, match any of "*", "-", "_", "<" or "=".
     :return: True if the line is a divider, False otherwise
     """
-    stripped_line = line.strip()
-    if type is None:
-        return bool(re.match(r"^\s*([\*\-\_]{3,}|<->|={3,})\s*$", stripped_line))
-    elif type == "*":
-        return bool(re.match(r"^\s*\*{3,}\s*$", stripped_line))
-    elif type == "-":
-        return bool(re.match(r"^\s*\-{3,}\s*$", stripped_line))
-    elif type == "_":
-        return bool(re.match(r"^\s*_{3,}\s*$", stripped_line))
-    elif type == "<":
-        return bool(re.match(r"^\s*<->\s*$", stripped_line))
-    elif type == "=":
-        return bool(re.match(r"^\s*={3,}\s*$", stripped_line))
-    else:
+    pattern = _DIVIDER_PATTERNS.get(type)
+    if pattern is None:
         return False
+    return bool(pattern.match(line.strip()))
 
 
 def contains_image(line: str) -> bool:
@@ -74,7 +141,7 @@ def contains_image(line: str) -> bool:
     :param line: The line to check
     :return: True if the line contains an image, False otherwise
     """
-    return bool(re.search(r"!\[.*?\]\(.*?\)", line))
+    return bool(_IMAGE_PATTERN.search(line))
 
 
 def contains_deco(line: str) -> bool:
@@ -85,7 +152,7 @@ def contains_deco(line: str) -> bool:
     :param line: The line to check
     :return: True if the line contains a deco, False otherwise
     """
-    return bool(re.match(r"^\s*@\(.*?\)\s*$", line))
+    return bool(_DECO_PATTERN.match(line))
 
 
 def extract_title(document: str) -> Optional[str]:
@@ -0,0 +1,215 @@
+"""
+Caches syntax highlighting of code, so that snippets repeated across slides and builds are
+highlighted by Pygments once. Replaces the highlighter that pymdownx superfences and
+inlinehilite use, and must be loaded before them.
+Results are kept in memory, and on disk inside a `highlight_cache_dir` block.
+Blocks longer than `max_lines` lines are not highlighted at all, see `CachedHighlightExtension`
+and `highlight_limit`. They are emitted as plain <code class="language-x"> blocks, nothing
+highlights them later.
+"""
+
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+import xml.etree.ElementTree as etree
+from pymdownx.highlight import Highlight, HighlightExtension
+from moffee.utils.build_cache import hash_key, touch
+
+try:
+    from pygments import __version__ as pygments_version
+except ImportError:  # pragma: no cover
+    pygments_version = None
+
+DEFAULT_CACHE_SIZE = 4096
+
+
+class HighlightCache:
+    """
+    Least-recently-used cache of highlighted code, with hit/miss counters.
+    Entries are stored on disk as well under the directory of `highlight_cache_dir`.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    @staticmethod
+    def _path(cache_dir: str, key: str) -> str:
+        return os.path.join(cache_dir, "highlight", key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[list]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return entry
+
+        cache_dir = current_highlight_cache_dir()
+        if cache_dir:
+            try:
+                with open(self._path(cache_dir, key), encoding="utf8") as f:
+                    entry = json.load(f)["entry"]
+                touch(self._path(cache_dir, key))
+            except (OSError, ValueError, KeyError, TypeError):
+                entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, entry: list):
+        self._remember(key, entry)
+        cache_dir = current_highlight_cache_dir()
+        if cache_dir:
+            path = self._path(cache_dir, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf8") as f:
+                json.dump({"entry": entry}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+
+    def _remember(self, key: str, entry: list):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+
+cache = HighlightCache()
+
+_cache_dir: ContextVar[Optional[str]] = ContextVar(
+    "moffee_highlight_cache_dir", default=None
+)
+
+
+def current_highlight_cache_dir() -> Optional[str]:
+    """The directory of the enclosing `highlight_cache_dir` block, if any"""
+    return _cache_dir.get()
+
+
+@contextmanager
+def highlight_cache_dir(cache_dir: Optional[str]):
+    """Store highlighted code under cache_dir for all markdown converted inside the with-block"""
+    token = _cache_dir.set(cache_dir)
+    try:
+        yield cache_dir
+    finally:
+        _cache_dir.reset(token)
+
+
+_max_lines: ContextVar[Optional[int]] = ContextVar(
+    "moffee_highlight_max_lines", default=None
+)
+
+
+def current_highlight_limit() -> Optional[int]:
+    """The limit of the enclosing `highlight_limit` block, if any"""
+    return _max_lines.get()
+
+
+@contextmanager
+def highlight_limit(max_lines: Optional[int]):
+    """
+    Leave code blocks with more than max_lines lines unhighlighted for all markdown converted
+    inside the with-block, 0 for no limit. Overrides the max_lines config of the extension.
+    """
+    token = _max_lines.set(max_lines)
+    try:
+        yield max_lines
+    finally:
+        _max_lines.reset(token)
+
+
+class CachedHighlight(Highlight):
+    """Highlight that reuses results for the same code, language and options"""
+
+    # Set on subclasses created by `CachedHighlightExtension.get_pymdownx_highlighter`
+    max_lines = 0
+
+    def _settings(self) -> dict:
+        return {name: value for name, value in vars(self).items() if name != "md"}
+
+    def highlight(self, src, language, *args, **kwargs):
+        inline = kwargs.get("inline", False)
+        max_lines = current_highlight_limit()
+        if max_lines is None:
+            max_lines = self.max_lines
+        if not inline and max_lines and src.count("\n") >= max_lines:
+            # Too large to highlight, leave the code plain
+            self.use_pygments = False
+
+        options = dict(kwargs)
+        if not (self.line_spans or self.line_anchors):
+            # Only used to number line ids
+            options.pop("code_block_count", None)
+        if options.get("title") and self.title_mode == "html":
+            # Html titles are stashed in the converter, and cannot be reused
+            return super().highlight(src, language, *args, **kwargs)
+
+        key = hash_key(pygments_version, self._settings(), src, language, args, options)
+        entry = cache.get(key)
+        if entry is None:
+            result = super().highlight(src, language, *args, **kwargs)
+            if inline:
+                entry = ["inline", result.text, dict(result.attrib)]
+            else:
+                entry = ["block", result]
+            cache.put(key, entry)
+
+        if entry[0] == "inline":
+            element = etree.Element("code", entry[2])
+            element.text = entry[1]
+            return element
+        return entry[1]
+
+
+class CachedHighlightExtension(HighlightExtension):
+    """
+    pymdownx.highlight settings with a cached highlighter. Like when superfences loads
+    pymdownx.highlight itself, indented code blocks are left alone.
+
+    :param max_lines: Blocks with more lines are not highlighted, 0 for no limit
+    """
+
+    def __init__(self, **kwargs):
+        max_lines = kwargs.pop("max_lines", 0)
+        kwargs.setdefault("_enabled", False)
+        super().__init__(**kwargs)
+        self.config["max_lines"] = [
+            max_lines,
+            "Leave blocks with more lines unhighlighted, 0 for no limit - Default: 0",
+        ]
+
+    def get_pymdownx_highlighter(self):
+        return type(
+            "BoundCachedHighlight",
+            (CachedHighlight,),
+            {"max_lines": self.getConfig("max_lines")},
+        )
+
+
+def makeExtension(**kwargs):  # pragma: no cover
+    return CachedHighlightExtension(**kwargs)
@@ -0,0 +1,214 @@
+"""
+Converts TeX formulas to MathML while markdown is converted, so that pages need no
+typesetting in the browser. Formulas use the arithmatex syntax: $...$ and \\(...\\) inline,
+$$...$$, \\[...\\] and \\begin{env}...\\end{env} as blocks.
+Formulas are only converted inside a `math_renderer` block, and left to MathJax otherwise.
+
+Requires the optional latex2mathml package.
+"""
+
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cached_property
+from typing import Dict, Optional, Tuple
+import xml.etree.ElementTree as etree
+from markdown.extensions import Extension
+from pymdownx.arithmatex import (
+    RE_DOLLAR_BLOCK,
+    RE_SMART_DOLLAR_INLINE,
+    RE_BRACKET_BLOCK,
+    RE_BRACKET_INLINE,
+    RE_TEX_BLOCK,
+    BlockArithmatexProcessor,
+    InlineArithmatexPattern,
+)
+from moffee.utils.build_cache import hash_key, touch
+
+try:
+    import latex2mathml
+    import latex2mathml.converter
+except ImportError:  # pragma: no cover
+    latex2mathml = None
+
+# Where formulas are typeset: by MathJax in the browser, or into MathML at build time
+MATH_MODES = ("browser", "mathml")
+
+
+class MathRenderer:
+    """
+    Converts formulas to MathML, caching results by formula and display mode.
+    With cache_dir, results are also stored on disk and reused by later builds.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        if latex2mathml is None:
+            raise RuntimeError(
+                "Rendering math at build time requires latex2mathml, "
+                "install it with `pip install latex2mathml`"
+            )
+        self.cache_dir = cache_dir
+        self.version = getattr(latex2mathml, "__version__", "")
+        self.hits = 0
+        self.misses = 0
+        self._formulas: Dict[Tuple[str, bool], str] = {}
+        self._lock = threading.Lock()
+
+    @cached_property
+    def fingerprint(self) -> str:
+        """Identifies the output of the renderer"""
+        return hash_key("mathml", self.version)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, "math", key[:2], f"{key}.json")
+
+    def render(self, math: str, display: bool) -> str:
+        """
+        Convert a TeX formula to MathML.
+
+        :param math: The formula, without delimiters
+        :param display: True for block formulas, False for inline ones
+        :return: A <math> element as html
+        """
+        with self._lock:
+            html = self._formulas.get((math, display))
+        if html is not None:
+            self.hits += 1
+            return html
+
+        key = hash_key(self.fingerprint, math, display)
+        html = self._load(key) if self.cache_dir else None
+        if html is None:
+            self.misses += 1
+            html = self._convert(math, display)
+            if self.cache_dir:
+                self._store(key, html)
+        else:
+            self.hits += 1
+        with self._lock:
+            self._formulas[(math, display)] = html
+        return html
+
+    @staticmethod
+    def _convert(math: str, display: bool) -> str:
+        try:
+            return latex2mathml.converter.convert(
+                math, display="block" if display else "inline"
+            )
+        except Exception:
+            # Keep formulas the converter does not understand visible as TeX
+            element = etree.Element("code", {"class": "math-error"})
+            element.text = math
+            return etree.tostring(element, encoding="unicode")
+
+    def _load(self, key: str) -> Optional[str]:
+        try:
+            with open(self._path(key), encoding="utf8") as f:
+                html = json.load(f)["html"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        touch(self._path(key))
+        return html
+
+    def _store(self, key: str, html: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf8") as f:
+            json.dump({"html": html}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+# Renderers by cache directory, kept for the lifetime of the process
+_renderers: Dict[Optional[str], MathRenderer] = {}
+
+
+def get_math_renderer(cache_dir: Optional[str] = None) -> MathRenderer:
+    """The renderer storing formulas in cache_dir, created on first use"""
+    renderer = _renderers.get(cache_dir)
+    if renderer is None:
+        renderer = _renderers[cache_dir] = MathRenderer(cache_dir)
+    return renderer
+
+
+_renderer: ContextVar[Optional[MathRenderer]] = ContextVar(
+    "moffee_math_renderer", default=None
+)
+
+
+def current_math_renderer() -> Optional[MathRenderer]:
+    """The renderer of the enclosing `math_renderer` block, if any"""
+    return _renderer.get()
+
+
+@contextmanager
+def math_renderer(renderer: Optional[MathRenderer]):
+    """Convert formulas with renderer for all markdown converted inside the with-block"""
+    token = _renderer.set(renderer)
+    try:
+        yield renderer
+    finally:
+        _renderer.reset(token)
+
+
+class InlineMathPattern(InlineArithmatexPattern):
+    def __init__(self, pattern, md):
+        super().__init__(pattern, {})
+        self.md = md
+
+    def handleMatch(self, m, data):
+        renderer = current_math_renderer()
+        if renderer is None:
+            return None, None, None
+
+        groups = m.groups()
+        escapes = groups[0] or (groups[3] if len(groups) > 3 else None)
+        if escapes:
+            return super().handleMatch(m, data)
+        math = groups[2] or (groups[5] if len(groups) > 3 else None)
+        html = renderer.render(math, display=False)
+        return self.md.htmlStash.store(html), m.start(0), m.end(0)
+
+
+class BlockMathProcessor(BlockArithmatexProcessor):
+    def __init__(self, pattern, md):
+        super().__init__(pattern, {}, md)
+
+    def test(self, parent, block):
+        return current_math_renderer() is not None and super().test(parent, block)
+
+    def run(self, parent, blocks):
+        blocks.pop(0)
+        groups = self.match.groupdict()
+        math = groups.get("math") or groups.get("math2") or groups.get("math3") or ""
+        html = current_math_renderer().render(math, display=True)
+        element = etree.SubElement(parent, "div", {"class": "arithmatex"})
+        element.text = self.parser.md.htmlStash.store(html)
+        return True
+
+
+class MathExtension(Extension):
+    """Math extension for Python-Markdown."""
+
+    def extendMarkdown(self, md):
+        """Add math processors to Markdown instance."""
+        md.registerExtension(self)
+
+        # Same priorities as arithmatex: inline before backticks, blocks before paragraphs
+        inline = "|".join([RE_SMART_DOLLAR_INLINE, RE_BRACKET_INLINE])
+        md.inlinePatterns.register(
+            InlineMathPattern(f"(?:{inline})", md), "moffee_math_inline", 189.9
+        )
+        block = "|".join([RE_DOLLAR_BLOCK, RE_BRACKET_BLOCK, RE_TEX_BLOCK])
+        md.parser.blockprocessors.register(
+            BlockMathProcessor(rf"(?s)^(?:{block})[ ]*$", md),
+            "moffee_math_block",
+            79.9,
+        )
+
+
+def makeExtension(**kwargs):  # pragma: no cover
+    return MathExtension(**kwargs)
@@ -2,8 +2,21 @@ import os
 import tempfile
 import pytest
 import re
-from moffee.builder import build, render_jinja2, read_options, retrieve_structure
+import shutil
+import time
+from moffee.builder import (
+    build,
+    render_jinja2,
+    read_options,
+    retrieve_structure,
+    parse_document,
+    load_document,
+    render_document,
+    make_environment,
+)
 from moffee.compositor import composite
+from moffee.markdown import cache as html_cache
+from moffee.utils.build_cache import BuildCache, MemoryCache
 
 
 def template_dir(name="base"):
@@ -77,10 +90,34 @@ def test_read_options(setup_test_env):
     assert options.resource_dir == "resources"
 
 
+def test_parse_document():
+    doc = """---
+# YAML comment, not a title
+theme: beam
+background-color: 'red'
+---
+<!-- # Hidden -->
+# Title
+Text
+## Page
+Text
+"""
+    document = parse_document(doc)
+    assert document.title == "Title"
+    assert document.options.theme == "beam"
+    assert document.options.styles == {"background-color": "red"}
+    assert document.front_matter == {"theme": "beam", "background-color": "red"}
+    assert [page.h2 for page in document.pages] == [None, "Page"]
+    assert document.struct["headings"][0]["content"] == "Title"
+    assert set(document.timings) == {"parse", "composite", "structure"}
+
+
 def test_build(setup_test_env):
     temp_dir, doc_path, res_dir, output_dir = setup_test_env
     options = read_options(doc_path)
-    build(doc_path, output_dir, template_dir(), template_dir(options.theme))
+    document = build(doc_path, output_dir, template_dir(), template_dir(options.theme))
+    assert document.options == options
+    assert {"read", "render", "assets", "write"} <= set(document.timings)
     j = os.path.join
     with open(j(output_dir, "index.html"), encoding="utf8") as f:
         output_html = f.read()
@@ -90,7 +127,9 @@ def test_build(setup_test_env):
     assert os.path.exists(j(output_dir, "js"))
     assert os.path.exists(j(output_dir, "assets"))
     asset_dir = os.listdir(j(output_dir, "assets"))
-    assert len(asset_dir) == 2
+    # Both images have the same content, and are stored once
+    assert len(asset_dir) == 1
+    assert document.stats["assets"] == 1
     for name in asset_dir:
         assert name in output_html
 
@@ -99,6 +138,195 @@ def test_build(setup_test_env):
         assert len(f.readlines()) > 2
 
 
+def test_build_with_cache_copies_assets(setup_test_env):
+    temp_dir, doc_path, _, _ = setup_test_env
+    output_dir = os.path.join(temp_dir, "cached_output")
+    cache = BuildCache(os.path.join(temp_dir, ".moffee-build-cache"))
+    build(doc_path, output_dir, template_dir(), cache=cache)
+    with open(os.path.join(output_dir, "index.html"), encoding="utf8") as f:
+        html = f.read()
+
+    # Slides come from the cache, their assets are still copied
+    build(doc_path, output_dir, template_dir(), cache=cache)
+    assert cache.hits == 2
+    with open(os.path.join(output_dir, "index.html"), encoding="utf8") as f:
+        assert f.read() == html
+    assets = os.listdir(os.path.join(output_dir, "assets"))
+    assert len(assets) == 1
+    assert all(f"assets/{name}" in html for name in assets)
+
+
+def test_build_links_media_assets():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_path = os.path.join(temp_dir, "test.md")
+        video = os.path.join(temp_dir, "clip.mp4")
+        with open(video, "wb") as f:
+            f.write(b"\0" * 4096)
+        with open(doc_path, "w", encoding="utf8") as f:
+            f.write(
+                '# Video\n<video controls><source src="clip.mp4" type="video/mp4"></video>\n'
+            )
+
+        output_dir = os.path.join(temp_dir, "output")
+        document = build(doc_path, output_dir, template_dir(), asset_mode="hardlink")
+        (name,) = os.listdir(os.path.join(output_dir, "assets"))
+        assert document.assets == {name: video}
+        assert f'<source src="assets/{name}" type="video/mp4">' in document.html
+        # Linked, not copied
+        assert os.path.samefile(os.path.join(output_dir, "assets", name), video)
+
+
+def test_rebuild_only_writes_changes(setup_test_env):
+    temp_dir, doc_path, _, _ = setup_test_env
+    output_dir = os.path.join(temp_dir, "rebuilt_output")
+    build(doc_path, output_dir, template_dir(), template_dir("beam"))
+    stale_asset = os.path.join(output_dir, "assets", "stale.png")
+    with open(stale_asset, "w") as f:
+        f.write("left by an earlier build")
+
+    document = build(doc_path, output_dir, template_dir(), template_dir("beam"))
+    assert document.stats["template_files_written"] == 0
+    assert document.stats["assets_written"] == 0
+    assert not os.path.exists(stale_asset)
+    assert len(os.listdir(os.path.join(output_dir, "assets"))) == 1
+    assert not [name for name in os.listdir(output_dir) if name.endswith(".tmp")]
+
+
+def test_build_parallel_matches_serial(setup_test_env):
+    temp_dir, doc_path, _, _ = setup_test_env
+    outputs = []
+    for jobs in (1, 2):
+        output_dir = os.path.join(temp_dir, f"output_jobs_{jobs}")
+        document = build(doc_path, output_dir, template_dir(), jobs=jobs)
+        with open(os.path.join(output_dir, "index.html"), encoding="utf8") as f:
+            outputs.append(f.read())
+        # Assets found by worker processes are copied too
+        (asset,) = os.listdir(os.path.join(output_dir, "assets"))
+        assert f"assets/{asset}" in outputs[-1]
+        assert document.stats["assets"] == 1
+    assert outputs[0] == outputs[1]
+
+
+def test_benchmark_parallel_rendering():
+    doc = "".join(
+        f"## Slide {i}\n"
+        + "".join(
+            f"Some *text* {i}.{j} with `code` and a [link](http://x)\n\n"
+            for j in range(20)
+        )
+        for i in range(200)
+    )
+    html = None
+    for jobs in (1, 4, 8, 16):
+        # Worker processes start with the chunk cache of this process
+        html_cache.clear()
+        document = parse_document(doc)
+        start = time.perf_counter()
+        result = render_document(document, template_dir(), jobs=jobs)
+        elapsed = time.perf_counter() - start
+        print(f"{jobs} jobs on {os.cpu_count()} CPUs: {elapsed:.2f}s")
+        assert html is None or result == html
+        html = result
+
+
+def test_environment_is_reused_until_templates_change():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        templates = os.path.join(temp_dir, "templates")
+        shutil.copytree(template_dir(), templates)
+        env = make_environment(templates)
+        assert make_environment([templates]) is env
+        assert make_environment([templates, template_dir("beam")]) is not env
+
+        template = env.get_template("slide.html")
+        assert env.get_template("slide.html") is template
+
+        slide = os.path.join(templates, "slide.html")
+        with open(slide, "a", encoding="utf8") as f:
+            f.write("<!-- edited -->")
+        stat = os.stat(slide)
+        os.utime(slide, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert env.get_template("slide.html") is not template
+        assert "edited" in render_jinja2("# Title", templates)
+
+
+def test_bytecode_cache():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = BuildCache(os.path.join(temp_dir, ".moffee-cache"))
+        render_jinja2("# Title", template_dir(), cache)
+        assert os.listdir(cache.bytecode_dir)
+
+
+def test_rendering_with_cache(setup_test_env):
+    temp_dir, doc_path, _, _ = setup_test_env
+    with open(doc_path, encoding="utf8") as f:
+        doc = f.read()
+    cache = BuildCache(os.path.join(temp_dir, ".moffee-cache"))
+
+    html = render_jinja2(doc, template_dir(), cache)
+    assert cache.hits == 0 and cache.misses == 2
+
+    assert render_jinja2(doc, template_dir(), cache) == html
+    assert cache.hits == 2
+
+    # Changing a slide only re-renders that slide
+    render_jinja2(doc.replace("Paragraph 1", "Paragraph 0"), template_dir(), cache)
+    assert cache.hits == 3 and cache.misses == 3
+
+
+def test_build_cache_prune():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = BuildCache(os.path.join(temp_dir, ".moffee-cache"))
+        for i in range(4):
+            cache.put(f"{i:02d}" * 32, (f"<p>{i}</p>" * 100, []))
+            path = cache._path(f"{i:02d}" * 32)
+            os.utime(path, ns=(0, 10**9 * (i + 1)))
+        size = os.path.getsize(cache._path("00" * 32))
+        # Reading an entry makes it the most recently used
+        assert cache.get("00" * 32) is not None
+
+        cache.max_size = 2 * size
+        assert cache.prune() == 2
+        assert cache.get("00" * 32) is not None
+        assert cache.get("03" * 32) is not None
+        assert cache.get("01" * 32) is None
+        assert cache.get("02" * 32) is None
+        assert cache.prune() == 0
+
+
+def test_build_prunes_cache(setup_test_env):
+    temp_dir, doc_path, _, _ = setup_test_env
+    cache = BuildCache(os.path.join(temp_dir, ".moffee-prune-cache"), max_size=0)
+    output_dir = os.path.join(temp_dir, "pruned_output")
+    document = build(doc_path, output_dir, template_dir(), cache=cache)
+    assert document.stats["cache_entries_pruned"] == 2
+    entries = [
+        name
+        for _, _, filenames in os.walk(os.path.join(cache.cache_dir, "slides"))
+        for name in filenames
+    ]
+    assert entries == []
+    # Compiled templates are not entries
+    assert os.listdir(cache.bytecode_dir)
+    shutil.rmtree(cache.cache_dir)
+
+
+def test_rendering_incremental():
+    doc = "# Title\n## Page 1\nText 1\n## Page 2\nText 2\n## Page 3\nText 3"
+    cache = MemoryCache()
+    html = render_jinja2(doc, template_dir(), cache)
+    assert cache.misses == 3
+    cache.swap()
+
+    edited = render_jinja2(doc.replace("Text 2", "Edited"), template_dir(), cache)
+    assert cache.hits == 2 and cache.misses == 1
+    assert edited == html.replace("Text 2", "Edited")
+    cache.swap()
+
+    # Only slides of the latest build are kept
+    render_jinja2(doc, template_dir(), cache)
+    assert cache.hits == 2 and cache.misses == 1
+
+
 def test_retrieve_structure():
     doc = """
 # Title
@@ -0,0 +1,206 @@
+import base64
+import os
+import re
+import tempfile
+import urllib.request
+import pytest
+from click.testing import CliRunner
+from moffee.builder import build
+from moffee.cli import cli
+from moffee.utils.bundle import (
+    BUNDLE_MODES,
+    VENDOR_DIR_VARIABLE,
+    VENDOR_FILES,
+    fetch_vendor,
+    inline_page,
+)
+
+
+def template_dir(name="base"):
+    return os.path.join(os.path.dirname(__file__), "..", "moffee", "templates", name)
+
+
+@pytest.fixture
+def vendor_dir(monkeypatch):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for relpath in VENDOR_FILES:
+            path = os.path.join(temp_dir, *relpath.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf8") as f:
+                if relpath.endswith(".js"):
+                    f.write("var end = '</script>';")
+                elif relpath.endswith(".svg"):
+                    f.write('<svg xmlns="http://www.w3.org/2000/svg"/>')
+                else:
+                    f.write(f"/* {relpath} */")
+        monkeypatch.setenv(VENDOR_DIR_VARIABLE, temp_dir)
+        yield temp_dir
+
+
+@pytest.fixture
+def deck():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_path = os.path.join(temp_dir, "test.md")
+        with open(doc_path, "w", encoding="utf8") as f:
+            f.write("# Bundled\n![Image](image.png)\n\n[Link](image.png)\n")
+        with open(os.path.join(temp_dir, "image.png"), "wb") as f:
+            f.write(bytes(range(256)) * 1000)
+        yield temp_dir, doc_path
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    def urlopen(url):
+        raise OSError("network unreachable")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        monkeypatch.setenv(VENDOR_DIR_VARIABLE, temp_dir)
+        monkeypatch.setattr(urllib.request, "urlopen", urlopen)
+        yield temp_dir
+
+
+def test_inline_page():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        j = os.path.join
+        os.mkdir(j(temp_dir, "css"))
+        with open(j(temp_dir, "image.png"), "wb") as f:
+            f.write(b"\x89PNG fake")
+        with open(j(temp_dir, "css", "style.css"), "w") as f:
+            f.write(
+                "a { background: url('../image.png') } b { mask: url(https://x.org/i.svg) }"
+            )
+        with open(j(temp_dir, "main.js"), "w") as f:
+            f.write("let s = '</script>';" * 10000)
+        with open(j(temp_dir, "index.html"), "w") as f:
+            f.write(
+                '<link rel="stylesheet" href="css/style.css">\n'
+                '<link rel="icon" href="image.png">\n'
+                '<script src="https://cdn.example.com/lib.js"></script>\n'
+                '<script id="main" src="main.js"></script>\n'
+                '<img alt="x" src="image.png" width="10">\n'
+                '<a href="image.png">link</a>\n'
+            )
+
+        output = j(temp_dir, "single.html")
+        assert inline_page(j(temp_dir, "index.html"), output) == 4
+        with open(output) as f:
+            html = f.read()
+
+    encoded = base64.b64encode(b"\x89PNG fake").decode()
+    assert f'<style>a {{ background: url("data:image/png;base64,{encoded}")' in html
+    assert "url(https://x.org/i.svg)" in html
+    assert f'<link rel="icon" href="data:image/png;base64,{encoded}">' in html
+    assert '<script src="https://cdn.example.com/lib.js"></script>' in html
+    assert '<script id="main">' in html
+    # Scripts never end early, even where blocks are split
+    assert html.count("</script>") == 2
+    assert html.count("<\\/script>") == 10000
+    assert f'<img alt="x" src="data:image/png;base64,{encoded}" width="10">' in html
+    assert '<a href="image.png">link</a>' in html
+
+
+def test_build_bundle_directory(vendor_dir, deck):
+    temp_dir, doc_path = deck
+    output_dir = os.path.join(temp_dir, "output")
+    build(doc_path, output_dir, template_dir(), bundle="directory")
+
+    with open(os.path.join(output_dir, "index.html"), encoding="utf8") as f:
+        html = f.read()
+    assert "cdn.jsdelivr.net" not in html
+    assert 'href="vendor/bootstrap.min.css"' in html
+    assert 'src="vendor/mermaid.min.js"' in html
+    for relpath in VENDOR_FILES:
+        assert os.path.isfile(os.path.join(output_dir, "vendor", *relpath.split("/")))
+    with open(os.path.join(output_dir, "css", "styles.css"), encoding="utf8") as f:
+        css = f.read()
+    assert "cdn.jsdelivr.net" not in css
+    assert "url('../vendor/icons/info-circle-fill.svg')" in css
+
+    # Rebuilding an unchanged deck writes nothing, and keeps the localized stylesheet
+    styles = os.path.join(output_dir, "css", "styles.css")
+    mtime = os.stat(styles).st_mtime_ns
+    document = build(doc_path, output_dir, template_dir(), bundle="directory")
+    assert document.stats["template_files_written"] == 0
+    assert document.stats["bundle_files_written"] == 0
+    assert os.stat(styles).st_mtime_ns == mtime
+
+    # Vendored files go away without --bundle
+    assert os.path.isdir(os.path.join(output_dir, "vendor"))
+    build(doc_path, output_dir, template_dir())
+    assert not os.path.exists(os.path.join(output_dir, "vendor"))
+    with open(os.path.join(output_dir, "index.html"), encoding="utf8") as f:
+        assert "cdn.jsdelivr.net" in f.read()
+
+
+def test_build_bundle_single(vendor_dir, deck):
+    temp_dir, doc_path = deck
+    output_dir = os.path.join(temp_dir, "output")
+    document = build(doc_path, output_dir, template_dir(), bundle="single")
+
+    assert os.listdir(output_dir) == ["index.html"]
+    assert document.stats["files_inlined"] > 0
+    with open(os.path.join(output_dir, "index.html"), encoding="utf8") as f:
+        html = f.read()
+    assert "cdn.jsdelivr.net" not in html
+    assert not re.search(r'<(?:script|img)[^>]*src="(?!data:)', html)
+    assert '<link href="' not in html
+    match = re.search(r'<img alt="Image" src="data:image/png;base64,([^"]*)"', html)
+    assert base64.b64decode(match.group(1)) == bytes(range(256)) * 1000
+    # Links keep pointing to files
+    assert 'href="assets/' in html
+
+
+def test_fetch_vendor_offline(offline):
+    with pytest.raises(RuntimeError, match="moffee vendor"):
+        fetch_vendor(force=True)
+    assert os.listdir(offline) == []
+
+
+@pytest.mark.parametrize("bundle", BUNDLE_MODES)
+def test_build_bundle_offline_writes_nothing(offline, deck, bundle):
+    temp_dir, doc_path = deck
+    output_dir = os.path.join(temp_dir, "output")
+    with pytest.raises(RuntimeError, match="moffee vendor"):
+        build(doc_path, output_dir, template_dir(), bundle=bundle)
+    assert not os.path.exists(output_dir)
+
+
+@pytest.mark.parametrize(
+    "args, mode",
+    [
+        (["--bundle", "{doc}"], "directory"),
+        (["{doc}", "--bundle"], "directory"),
+        (["--bundle-mode", "single", "{doc}"], "single"),
+        (["--bundle", "--bundle-mode", "single", "{doc}"], "single"),
+        (["{doc}"], None),
+    ],
+)
+def test_cli_bundle(vendor_dir, deck, args, mode):
+    temp_dir, doc_path = deck
+    output_dir = os.path.join(temp_dir, "output")
+    args = [arg.format(doc=doc_path) for arg in args]
+    result = CliRunner().invoke(cli, ["make", *args, "-o", output_dir])
+    assert result.exit_code == 0, result.output
+
+    files = os.listdir(output_dir)
+    if mode == "single":
+        assert files == ["index.html"]
+    else:
+        assert {"index.html", "assets", "css", "js"} <= set(files)
+        assert ("vendor" in files) == (mode == "directory")
+
+
+def test_cli_bundle_offline(offline, deck):
+    temp_dir, doc_path = deck
+    output_dir = os.path.join(temp_dir, "output")
+    result = CliRunner().invoke(cli, ["make", "--bundle", doc_path, "-o", output_dir])
+    assert result.exit_code == 1
+    assert "Error: Cannot download" in result.output
+    assert "moffee vendor" in result.output
+    assert not os.path.exists(output_dir)
+
+
+def test_build_bundle_unknown_mode(deck):
+    temp_dir, doc_path = deck
+    with pytest.raises(ValueError):
+        build(doc_path, os.path.join(temp_dir, "output"), template_dir(), bundle="zip")
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import pytest
+from moffee.cli import find_documents, deck_output_dirs, run_batch
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf8") as f:
+        f.write(content)
+
+
+@pytest.fixture
+def setup_test_env():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        decks = os.path.join(temp_dir, "decks")
+        write(os.path.join(decks, "intro.md"), "# Intro\nHello\n---\nWorld")
+        write(os.path.join(decks, "week1", "intro.md"), "---\ntheme: beam\n---\n# W1")
+        write(os.path.join(decks, "week1", "notes.txt"), "not a deck")
+        write(os.path.join(decks, ".moffee-cache", "hidden.md"), "# Hidden")
+        yield temp_dir, decks
+
+
+def test_find_documents(setup_test_env):
+    temp_dir, decks = setup_test_env
+    intro, week1 = os.path.join(decks, "intro.md"), os.path.join(
+        decks, "week1", "intro.md"
+    )
+    assert find_documents([decks]) == [intro, week1]
+    assert find_documents([os.path.join(decks, "*", "*.md")]) == [week1]
+    # Files are listed once, in argument order
+    assert find_documents([week1, decks]) == [week1, intro]
+    assert find_documents([os.path.join(decks, "missing*.md")]) == []
+
+
+def test_deck_output_dirs():
+    output_dirs = deck_output_dirs(["a/intro.md", "a/b/intro.md"], "out")
+    assert output_dirs == [
+        os.path.join("out", "intro"),
+        os.path.join("out", "b", "intro"),
+    ]
+
+
+def test_deck_output_dirs_never_nest():
+    documents = ["lec/a.md", "lec/a/b.md", "lec/a/assets.md", "lec/a-deck.md"]
+    output_dirs = deck_output_dirs(documents, "out")
+    assert output_dirs == [
+        os.path.join("out", "a-deck-2"),
+        os.path.join("out", "a", "b"),
+        os.path.join("out", "a", "assets"),
+        os.path.join("out", "a-deck"),
+    ]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_batch_nested_decks(setup_test_env, jobs):
+    temp_dir, decks = setup_test_env
+    output = os.path.join(temp_dir, "output")
+    write(os.path.join(decks, "week1.md"), "# Week 1\n![Image](week1/image.png)")
+    write(os.path.join(decks, "week1", "image.png"), "image")
+    write(os.path.join(decks, "week1", "assets.md"), "# Assets")
+    documents = find_documents([os.path.join(decks, "week1", "intro.md"), decks])
+
+    assert run_batch(documents, output, jobs=jobs) == 0
+    # Every deck keeps its files, no build prunes another one
+    for deck_output in deck_output_dirs(documents, output):
+        assert os.path.exists(os.path.join(deck_output, "index.html"))
+        assert os.path.exists(os.path.join(deck_output, "js", "main.js"))
+    assert os.listdir(os.path.join(output, "week1-deck", "assets"))
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_batch(setup_test_env, capsys, jobs):
+    temp_dir, decks = setup_test_env
+    output = os.path.join(temp_dir, "output")
+    with open(os.path.join(decks, "broken.md"), "wb") as f:
+        f.write(b"# Not utf8 \xff")
+    documents = find_documents([decks])
+
+    assert run_batch(documents, output, jobs=jobs) == 1
+    assert os.path.exists(os.path.join(output, "intro", "index.html"))
+    assert os.path.exists(os.path.join(output, "week1", "intro", "index.html"))
+    with open(
+        os.path.join(output, "week1", "intro", "index.html"), encoding="utf8"
+    ) as f:
+        assert "W1" in f.read()
+
+    summary = capsys.readouterr().out
+    assert "2 slides" in summary
+    assert "FAILED" in summary
+    assert "Built 2 of 3 decks" in summary
@@ -0,0 +1,174 @@
+import time
+import tracemalloc
+from copy import deepcopy
+from moffee.compositor import (
+    composite,
+    iter_pages,
+    iter_line_spans,
+    Page,
+    PageOption,
+    Chunk,
+    Type,
+    NO_CHILDREN,
+)
+
+
+def test_iter_line_spans():
+    doc = "a\n\nbc\n"
+    assert [doc[s:e] for s, e in iter_line_spans(doc)] == doc.split("\n")
+
+
+def test_iter_pages_matches_baseline():
+    doc = """
+---
+default_h1: true
+---
+# Title
+@(layout=centered)
+Intro
+## Section
+Text
+---
+@(background=red)
+Next
+"""
+    # Expected values are those of composite() before it was built on iter_pages()
+    pages = list(iter_pages(doc))
+    assert [p.raw_md for p in pages] == ["Intro", "Text", "Next"]
+    assert [(p.h1, p.h2, p.h3) for p in pages] == [
+        ("Title", None, None),
+        ("Title", "Section", None),
+        ("Title", "Section", None),
+    ]
+    assert [p.option for p in pages] == [
+        PageOption(default_h1=True, layout="centered"),
+        PageOption(default_h1=True),
+        PageOption(default_h1=True, styles={"background": "red"}),
+    ]
+    assert [(p.raw_md, p.option) for p in composite(doc)] == [
+        (p.raw_md, p.option) for p in pages
+    ]
+
+
+def test_iter_pages_is_lazy():
+    pages = iter_pages("# Page 1\nText\n# Page 2\nText")
+    first = next(pages)
+    assert first.h1 == "Page 1"
+    assert next(pages).h1 == "Page 2"
+
+
+def test_benchmark_long_page_is_linear():
+    def elapsed(n_lines):
+        doc = "# Title\n" + "A line of slide content\n" * n_lines
+        start = time.perf_counter()
+        page = composite(doc)[0]
+        page.chunk
+        return time.perf_counter() - start
+
+    small, large = elapsed(20000), elapsed(80000)
+    print(f"20k lines: {small * 1e3:.1f}ms, 80k lines: {large * 1e3:.1f}ms")
+    # 4x the input should take roughly 4x the time, far from the 16x of quadratic growth
+    assert large < small * 10
+
+
+def test_chunk_is_cached_until_raw_md_changes():
+    page = composite("Left\n<->\nRight")[0]
+    chunk = page.chunk
+    assert page.chunk is chunk
+    assert [c.paragraph.strip() for c in chunk.children] == ["Left", "Right"]
+
+    page.raw_md = "Top\n===\nBottom"
+    assert page.chunk is not chunk
+    assert page.chunk.direction == "vertical"
+
+
+def test_chunk_single_pass_dividers():
+    doc = "A\n<->\nB\n===\n```\n<->\n===\n```\n===\nC\n<->\nD"
+    chunk = composite(doc)[0].chunk
+    assert chunk.direction == "vertical"
+    top, middle, bottom = chunk.children
+    assert [c.paragraph.strip() for c in top.children] == ["A", "B"]
+    assert middle.paragraph.strip() == "```\n<->\n===\n```"
+    assert [c.paragraph.strip() for c in bottom.children] == ["C", "D"]
+
+
+def test_pages_share_options():
+    doc = "---\ncolor: red\n---\n" + "".join(
+        f"## Page {i}\n@(layout=centered)\nText\n## Plain {i}\nText\n"
+        for i in range(50)
+    )
+    pages = composite(doc)
+    decorated, plain = pages[0::2], pages[1::2]
+    assert all(p.option is plain[0].option for p in plain)
+    assert all(p.option is decorated[0].option for p in decorated)
+    assert decorated[0].option.layout == "centered"
+    assert decorated[0].option.styles is plain[0].option.styles
+
+
+def test_benchmark_option_memory():
+    doc = "".join(
+        f"## Page {i}\n@(layout=centered, background-color=red)\n@(font-size={i % 5}em)\nText\n"
+        for i in range(300)
+    )
+    # Warm up caches of parsed decorators, so both builds below start alike
+    composite(doc)
+
+    def footprint(copy_options):
+        tracemalloc.start()
+        pages = composite(doc)
+        if copy_options:
+            for page in pages:
+                page.option = deepcopy(page.option)
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return pages, size
+
+    pages, shared_size = footprint(copy_options=False)
+    _, copied_size = footprint(copy_options=True)
+    print(
+        f"300 decorated slides: {shared_size / 1024:.0f}KiB with shared options, "
+        f"{copied_size / 1024:.0f}KiB with an option copy per page"
+    )
+    # Pages with the same decorations share one option object
+    for i, page in enumerate(pages):
+        assert page.option is pages[i % 5].option
+        assert page.option.styles == {
+            "background-color": "red",
+            "font-size": f"{i % 5}em",
+        }
+    assert len({id(p.option) for p in pages}) == 5
+    assert shared_size < copied_size
+
+
+def test_benchmark_slide_memory():
+    # Stand-ins for the previous layout: per-instance __dict__ and an empty list per paragraph
+    class DictPage(Page):
+        pass
+
+    class DictChunk(Chunk):
+        pass
+
+    option = PageOption()
+
+    def footprint(page_cls, chunk_cls, empty_children):
+        tracemalloc.start()
+        pages = []
+        for i in range(2000):
+            page = page_cls(raw_md="", option=option, h1="Title", h2=f"{i}")
+            page._chunk = chunk_cls(
+                children=[
+                    chunk_cls(paragraph="", children=empty_children()) for _ in range(3)
+                ],
+                type=Type.NODE,
+            )
+            pages.append(page)
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return size / len(pages)
+
+    before = footprint(DictPage, DictChunk, list)
+    after = footprint(Page, Chunk, lambda: NO_CHILDREN)
+    print(f"per slide: {before:.0f}B before, {after:.0f}B after")
+    assert not hasattr(Page(raw_md="", option=PageOption()), "__dict__")
+    assert Chunk().children is NO_CHILDREN
+    assert after < before
@@ -2,9 +2,15 @@ import os
 import pytest
 import shutil
 import tempfile
+import time
+import uuid
 
 from moffee.utils.file_helper import (
+    ASSET_MODES,
+    asset_name,
     copy_assets,
+    place_asset,
+    rewrite_attributes,
 )
 
 
@@ -163,3 +169,127 @@ def test_copy_assets_ignores_urls_in_text_content():
     assert updated_doc.count(sample_file_path) == 2
 
     shutil.rmtree(temp_dir)
+
+
+def test_copy_assets_is_deterministic_and_dedupes(setup_test_environment):
+    temp_dir, sample_image_path, _ = setup_test_environment
+    target_dir = os.path.join(temp_dir, "asset_resources")
+    duplicate_path = os.path.join(temp_dir, "duplicate.png")
+    shutil.copy(sample_image_path, duplicate_path)
+
+    html_doc = f'<img src="{sample_image_path}"><img src="{duplicate_path}">'
+    updated_doc = copy_assets(html_doc, target_dir)
+
+    # Same content is stored once, under a name that only depends on the content
+    assert os.listdir(target_dir) == [asset_name(sample_image_path)]
+    assert (
+        updated_doc.count(os.path.join(target_dir, asset_name(sample_image_path))) == 2
+    )
+
+    # Later builds produce the same output without copying again
+    mtime = os.stat(os.path.join(target_dir, asset_name(sample_image_path))).st_mtime_ns
+    assert copy_assets(html_doc, target_dir) == updated_doc
+    assert (
+        os.stat(os.path.join(target_dir, asset_name(sample_image_path))).st_mtime_ns
+        == mtime
+    )
+
+    # Edited content gets a new name
+    with open(sample_image_path, "w") as f:
+        f.write("Edited image")
+    assert copy_assets(html_doc, target_dir) != updated_doc
+    assert len(os.listdir(target_dir)) == 2
+
+
+@pytest.mark.parametrize("mode", ASSET_MODES)
+def test_place_asset_modes(setup_test_environment, mode):
+    temp_dir, sample_image_path, _ = setup_test_environment
+    target = os.path.join(temp_dir, asset_name(sample_image_path))
+
+    assert place_asset(sample_image_path, target, mode)
+    assert not place_asset(sample_image_path, target, mode)
+    with open(target) as f:
+        assert f.read() == "This is a test image file."
+    if mode == "hardlink":
+        assert os.path.samefile(sample_image_path, target)
+    assert not [name for name in os.listdir(temp_dir) if name.endswith(".tmp")]
+
+
+def test_place_asset_unknown_mode(setup_test_environment):
+    temp_dir, sample_image_path, _ = setup_test_environment
+    with pytest.raises(ValueError):
+        place_asset(sample_image_path, os.path.join(temp_dir, "x.png"), "symlink")
+
+
+def test_rewrite_attributes_passes_other_bytes_through():
+    html_doc = """<p class='x'>Text &amp; <b>bold</b><br>
+<IMG alt="a" SRC='old.png' /><a href=old.png>link</a><img src>
+<script>var s = "<img src='old.png'>";</script><!-- <img src="old.png"> -->"""
+
+    updated_doc = rewrite_attributes(
+        html_doc, {"img": ("src",), "a": ("href",)}, lambda tag, attr, value: "n&w.png"
+    )
+
+    assert updated_doc == html_doc.replace(
+        "SRC='old.png'", 'SRC="n&amp;w.png"'
+    ).replace("href=old.png", 'href="n&amp;w.png"')
+
+
+def _copy_assets_bs4(document, target_dir):
+    """The previous BeautifulSoup implementation, for benchmarking"""
+    from bs4 import BeautifulSoup
+    from urllib.parse import urlparse
+
+    soup = BeautifulSoup(document, "html.parser")
+    path_mapping = {}
+    for tag, attr in [
+        ("img", "src"),
+        ("link", "href"),
+        ("script", "src"),
+        ("a", "href"),
+    ]:
+        for element in soup.find_all(tag):
+            if element.has_attr(attr):
+                original_path = element[attr]
+                if urlparse(original_path).scheme or not os.path.isfile(original_path):
+                    continue
+                if original_path not in path_mapping:
+                    name, ext = os.path.splitext(os.path.basename(original_path))
+                    new_path = os.path.join(
+                        target_dir, f"{str(uuid.uuid4())[:8]}_{name}{ext}"
+                    )
+                    shutil.copy2(original_path, new_path)
+                    path_mapping[original_path] = new_path
+                element[attr] = path_mapping[original_path]
+    return str(soup)
+
+
+def test_benchmark_copy_assets(setup_test_environment):
+    pytest.importorskip("bs4")
+    temp_dir, sample_image_path, _ = setup_test_environment
+    target_dir = os.path.join(temp_dir, "asset_resources")
+    os.makedirs(target_dir)
+
+    slide = f"""<div class="slide-container"><div class="slide-content" style="color: red;">
+<h2>Slide</h2><div class="chunk chunk-paragraph"><p>Some <strong>text</strong> and a
+<a href="https://example.com">link</a></p><p><img alt="x" src="{sample_image_path}" /></p>
+<ul><li>item</li><li>item</li></ul></div></div></div>
+"""
+    document = (
+        "<html><body>" + slide * (2 * 1024 * 1024 // len(slide)) + "</body></html>"
+    )
+
+    start = time.perf_counter()
+    _copy_assets_bs4(document, target_dir)
+    bs4_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    updated_doc = copy_assets(document, target_dir)
+    streaming_time = time.perf_counter() - start
+
+    print(
+        f"{len(document) / 1e6:.1f}MB deck: BeautifulSoup {bs4_time:.2f}s, "
+        f"streaming {streaming_time:.2f}s"
+    )
+    assert sample_image_path not in updated_doc
+    assert streaming_time < bs4_time
@@ -0,0 +1,209 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import urlopen
+import pytest
+from moffee.builder import build, render_deck
+from moffee.live import (
+    EVENTS_PATH,
+    FileWatcher,
+    LiveServer,
+    RebuildScheduler,
+    diff_pages,
+    split_page,
+)
+
+
+def template_dir(name="base"):
+    return os.path.join(os.path.dirname(__file__), "..", "moffee", "templates", name)
+
+
+@pytest.fixture
+def setup_test_env():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_path = os.path.join(temp_dir, "deck.md")
+        output_dir = os.path.join(temp_dir, "output")
+        with open(doc_path, "w", encoding="utf8") as f:
+            f.write("# Title\nFirst\n---\nSecond\n")
+
+        def rebuild():
+            return build(doc_path, output_dir, template_dir())
+
+        yield doc_path, output_dir, rebuild
+
+
+def edit(path, old, new):
+    with open(path, encoding="utf8") as f:
+        content = f.read()
+    with open(path, "w", encoding="utf8") as f:
+        f.write(content.replace(old, new))
+
+
+def test_split_page():
+    assert split_page("<a>x</a><b>x</b>", ["x", "x"]) == ("<a>", "</a><b>", "</b>")
+    assert split_page("<a>x</a>", ["y"]) is None
+
+
+def test_diff_pages(setup_test_env):
+    doc_path, _, rebuild = setup_test_env
+    first = rebuild()
+    assert diff_pages(None, first) == {"type": "reload"}
+    assert diff_pages(first, rebuild()) == {"type": "patch", "slides": {}}
+
+    edit(doc_path, "Second", "Edited")
+    edited = rebuild()
+    event = diff_pages(first, edited)
+    assert event["type"] == "patch"
+    assert list(event["slides"]) == [1]
+    assert "Edited" in event["slides"][1]
+
+    # Anything outside of slides needs the page to be reloaded
+    edit(doc_path, "# Title", "# Other title")
+    assert diff_pages(edited, rebuild()) == {"type": "reload"}
+    edit(doc_path, "Edited", "Edited\n---\nThird")
+    assert diff_pages(edited, rebuild()) == {"type": "reload"}
+
+
+def test_file_watcher(setup_test_env):
+    doc_path, _, _ = setup_test_env
+    changed = threading.Event()
+    watcher = FileWatcher(lambda: [doc_path], changed.set, interval=0.01)
+    watcher.start()
+    try:
+        assert not changed.wait(0.05)
+        edit(doc_path, "Second", "Edited, with a new size")
+        assert changed.wait(2)
+    finally:
+        watcher.stop()
+
+
+def test_live_server_pushes_changed_slides(setup_test_env):
+    doc_path, output_dir, _ = setup_test_env
+    temp_dir = os.path.dirname(doc_path)
+    with open(os.path.join(temp_dir, "image.png"), "wb") as f:
+        f.write(b"fake image content")
+    edit(doc_path, "First", "![Image](image.png)")
+
+    def rebuild():
+        return render_deck(doc_path, template_dir())
+
+    server = LiveServer(rebuild, template_dir(), watch=[doc_path], port=0)
+    server.update(rebuild())
+    httpd = server.make_http_server()
+    port = httpd.server_address[1]
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        with urlopen(f"http://127.0.0.1:{port}/") as response:
+            page = response.read().decode("utf8")
+        assert "window.moffeeBuild = 1;" in page
+        assert page.index('<script src="js/live.js">') < page.index("</body>")
+        with urlopen(f"http://127.0.0.1:{port}/js/live.js") as response:
+            assert b"EventSource" in response.read()
+
+        # Assets are streamed from their source, nothing is written to disk
+        (asset,) = server.document.assets
+        assert f"assets/{asset}" in page
+        with urlopen(f"http://127.0.0.1:{port}/assets/{asset}") as response:
+            assert response.read() == b"fake image content"
+        for missing in ("assets/missing.png", "layouts/content.html", "../deck.md"):
+            with pytest.raises(HTTPError) as error:
+                urlopen(f"http://127.0.0.1:{port}/{missing}")
+            assert error.value.code == 404
+        assert not os.path.exists(output_dir)
+
+        events = urlopen(f"http://127.0.0.1:{port}{EVENTS_PATH}")
+
+        def next_event():
+            line = events.readline()
+            while not line.startswith(b"data: "):
+                line = events.readline()
+            return json.loads(line[len(b"data: ") :])
+
+        assert next_event() == {"type": "hello", "build": 1}
+        while not len(server.events):
+            time.sleep(0.01)
+
+        edit(doc_path, "Second", "Edited")
+        server.rebuild()
+        event = next_event()
+        assert event["type"] == "patch" and event["build"] == 2
+        assert list(event["slides"]) == ["1"]
+        assert "Edited" in event["slides"]["1"]
+        events.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+class FakeBuild:
+    def __init__(self, duration=0.0):
+        self.duration = duration
+        self.started = threading.Event()
+        self.builds = 0
+        self.published = []
+
+    def build(self):
+        self.builds += 1
+        self.started.set()
+        time.sleep(self.duration)
+        return self.builds
+
+    def publish(self, result):
+        self.published.append(result)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_scheduler_coalesces_bursts():
+    fake = FakeBuild()
+    scheduler = RebuildScheduler(fake.build, fake.publish, delay=0.05)
+    scheduler.start()
+    try:
+        for _ in range(5):
+            scheduler.request()
+        assert scheduler.queue_depth == 5
+        wait_for(lambda: fake.published)
+        time.sleep(0.1)
+        assert fake.published == [1]
+        assert scheduler.coalesced == 5 and scheduler.queue_depth == 0
+        assert scheduler.last_duration is not None
+    finally:
+        scheduler.stop()
+
+
+def test_scheduler_drops_superseded_builds():
+    fake = FakeBuild(duration=0.1)
+    scheduler = RebuildScheduler(fake.build, fake.publish, delay=0.01)
+    scheduler.start()
+    try:
+        scheduler.request()
+        assert fake.started.wait(2)
+        scheduler.request()
+        wait_for(lambda: fake.published)
+        assert fake.published == [2]
+        assert scheduler.builds == 2 and scheduler.dropped == 1
+    finally:
+        scheduler.stop()
+
+
+def test_scheduler_publishes_during_continuous_changes():
+    fake = FakeBuild(duration=0.02)
+    scheduler = RebuildScheduler(fake.build, fake.publish, delay=0, max_stale=0.1)
+    scheduler.start()
+    try:
+        deadline = time.monotonic() + 0.5
+        while time.monotonic() < deadline:
+            scheduler.request()
+            time.sleep(0.005)
+        assert fake.published
+        assert scheduler.dropped > 0
+    finally:
+        scheduler.stop()
@@ -0,0 +1,127 @@
+import time
+import pytest
+from markdown import markdown
+import moffee.markdown as moffee_markdown
+from moffee.markdown import (
+    md,
+    get_converter,
+    fingerprint,
+    HTMLCache,
+    extensions,
+    extension_configs,
+)
+
+SAMPLES = [
+    "Hello **world**",
+    "# Heading\n## Heading\nSame heading twice must keep unique ids",
+    "Footnote reference[^1]\n\n[^1]: The footnote",
+    "*[HTML]: Hyper Text Markup Language\nThe HTML specification",
+    "- [x] done\n- [ ] todo",
+    "```python\nprint('hi')\n```",
+    "```mermaid\ngraph TD;\nA-->B;\n```",
+    "!!! note\n    Admonition body",
+    "> [!warning] Careful\n> Obsidian callout",
+    "[[Wiki Link]] and https://example.com and ==mark== ^^ins^^ ~~del~~",
+    "Line one\nLine two",
+    "",
+]
+
+
+def fresh(text):
+    return markdown(text, extensions=extensions, extension_configs=extension_configs)
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_pooled_output_identical(text):
+    assert md(text) == fresh(text)
+
+
+def test_pooled_output_identical_after_reuse():
+    # Converting in sequence must not leak state (footnotes, toc ids, abbrs) between chunks
+    for text in SAMPLES + SAMPLES[::-1]:
+        assert md(text) == fresh(text)
+
+
+def test_converter_is_reused():
+    assert get_converter() is get_converter()
+
+
+def test_benchmark_pooled_converter():
+    chunks = [f"Chunk {i} with **bold** and `code`\n\n- item" for i in range(100)]
+
+    start = time.perf_counter()
+    expected = [fresh(c) for c in chunks]
+    fresh_time = time.perf_counter() - start
+
+    get_converter()  # warm up the pool, bypassing the html cache
+    start = time.perf_counter()
+    actual = [get_converter().convert(c) for c in chunks]
+    pooled_time = time.perf_counter() - start
+
+    print(
+        f"per chunk: fresh={fresh_time / len(chunks) * 1e3:.3f}ms, "
+        f"pooled={pooled_time / len(chunks) * 1e3:.3f}ms, "
+        f"speedup={fresh_time / pooled_time:.1f}x"
+    )
+    assert actual == expected
+    assert pooled_time < fresh_time
+
+
+@pytest.fixture
+def empty_cache():
+    moffee_markdown.cache.clear()
+    yield moffee_markdown.cache
+    moffee_markdown.cache.clear()
+
+
+def test_cache_counts_hits_and_misses(empty_cache):
+    md("cached **text**")
+    md("cached **text**")
+    md("other text")
+    assert empty_cache.hits == 1
+    assert empty_cache.misses == 2
+    assert len(empty_cache) == 2
+
+
+def test_cache_respects_size_bound():
+    cache = HTMLCache(maxsize=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")  # "b" becomes least recently used
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    cache.resize(0)
+    cache.put("d", "4")
+    assert len(cache) == 0
+
+
+def test_cache_keyed_by_extension_setup(empty_cache, monkeypatch):
+    before = fingerprint()
+    plain = md("~~strike~~")
+    monkeypatch.setattr(
+        moffee_markdown,
+        "extensions",
+        [e for e in extensions if e != "pymdownx.tilde"],
+    )
+    assert fingerprint() != before
+    assert md("~~strike~~") != plain
+    assert empty_cache.hits == 0
+
+
+def test_frozen_config_fingerprints_once(empty_cache, monkeypatch):
+    calls = []
+
+    def counting_fingerprint():
+        calls.append(1)
+        return fingerprint()
+
+    monkeypatch.setattr(moffee_markdown, "fingerprint", counting_fingerprint)
+    with moffee_markdown.frozen_config():
+        for _ in range(3):
+            md("Hello **world**")
+    assert len(calls) == 1
+    assert empty_cache.hits == 2
+    # Outside a build, changes to the extension setup are picked up by every call
+    md("Hello **world**")
+    assert len(calls) == 2
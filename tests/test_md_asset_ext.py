@@ -0,0 +1,110 @@
+import os
+import tempfile
+import pytest
+from markdown import markdown
+from moffee.markdown import md
+from moffee.utils.file_helper import AssetRegistry, asset_name
+from moffee.utils.md_asset_ext import asset_registry
+
+
+@pytest.fixture
+def setup_test_env():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_path = os.path.join(temp_dir, "test.md")
+        res_dir = os.path.join(temp_dir, "resources")
+        os.mkdir(res_dir)
+
+        with open(os.path.join(temp_dir, "image.png"), "w") as f:
+            f.write("fake image content")
+
+        with open(os.path.join(res_dir, "image2.png"), "w") as f:
+            f.write("another fake image content")
+
+        yield temp_dir, doc_path, res_dir
+
+
+def convert(text, registry):
+    with asset_registry(registry):
+        return markdown(text, extensions=["moffee.utils.md_asset_ext"])
+
+
+def test_no_registry():
+    text = "![Image](image.png)"
+    assert markdown(text, extensions=["moffee.utils.md_asset_ext"]) == markdown(text)
+
+
+def test_rewrite_markdown_urls(setup_test_env):
+    temp_dir, doc_path, res_dir = setup_test_env
+    registry = AssetRegistry(doc_path, "resources")
+    html = convert(
+        "![Image](image.png) ![Image](image2.png) [Link](http://example.com) ![Missing](missing.png)",
+        registry,
+    )
+
+    image, image2 = os.path.join(temp_dir, "image.png"), os.path.join(
+        res_dir, "image2.png"
+    )
+    assert f'src="assets/{asset_name(image)}"' in html
+    assert f'src="assets/{asset_name(image2)}"' in html
+    assert 'href="http://example.com"' in html
+    assert 'src="missing.png"' in html
+    assert registry.assets == {asset_name(image): image, asset_name(image2): image2}
+
+
+def test_rewrite_raw_html(setup_test_env):
+    temp_dir, doc_path, res_dir = setup_test_env
+    registry = AssetRegistry(doc_path, "resources")
+    html = convert(
+        '<div><img src="image.png"></div>\n\nText <img src="image2.png"> <iframe src="image.png"></iframe>\n\n'
+        '<video controls><source src="image2.png" type="video/mp4"></video>',
+        registry,
+    )
+
+    image = os.path.join(temp_dir, "image.png")
+    image2 = os.path.join(res_dir, "image2.png")
+    assert f'<img src="assets/{asset_name(image)}">' in html
+    assert f'<source src="assets/{asset_name(image2)}" type="video/mp4">' in html
+    # Only files of asset tags are copied, other urls become absolute
+    assert f'<iframe src="{image}">' in html
+    assert len(registry.assets) == 2
+
+
+def test_record_and_replay(setup_test_env):
+    temp_dir, doc_path, res_dir = setup_test_env
+    registry = AssetRegistry(doc_path, "resources")
+    with registry.record() as records:
+        registry.url_for("img", "image.png")
+        registry.url_for("a", "http://example.com")
+    assert records == [
+        (
+            "img",
+            "image.png",
+            "assets/" + asset_name(os.path.join(temp_dir, "image.png")),
+        ),
+        ("a", "http://example.com", None),
+    ]
+
+    fresh = AssetRegistry(doc_path, "resources")
+    assert fresh.replay(records)
+    assert fresh.assets == registry.assets
+
+    # Cached html is stale once a url resolves to different content
+    with open(os.path.join(temp_dir, "image.png"), "w") as f:
+        f.write("edited fake image content")
+    assert not AssetRegistry(doc_path, "resources").replay(records)
+
+
+def test_md_cache_replays_assets(setup_test_env):
+    temp_dir, doc_path, res_dir = setup_test_env
+    text = "![Image](image.png) unique to test_md_cache_replays_assets"
+    first = AssetRegistry(doc_path, "resources")
+    with asset_registry(first):
+        html = md(text)
+
+    second = AssetRegistry(doc_path, "resources")
+    with asset_registry(second):
+        assert md(text) == html
+    assert second.assets == first.assets and len(second.assets) == 1
+
+    # Without a registry urls are kept, and not served from the registry's entry
+    assert 'src="image.png"' in md(text)
@@ -1,5 +1,8 @@
+import time
 import pytest
 from moffee.utils.md_helper import (
+    classify_line,
+    LineKind,
     is_comment,
     is_empty,
     get_header_level,
@@ -51,6 +54,66 @@ def test_is_divider():
     assert is_divider("= = =") is False
 
 
+def test_classify_line():
+    assert classify_line("# Header 1") == 1
+    assert classify_line("### Header 3") == 3
+    assert classify_line("####### Not a valid header") == LineKind.TEXT
+    assert classify_line(" # Indented") == LineKind.TEXT
+    assert classify_line("Normal text") == LineKind.TEXT
+    assert classify_line("") == LineKind.BLANK
+    assert classify_line("  \t") == LineKind.BLANK
+    assert classify_line("<!-- comment -->") == LineKind.COMMENT
+    assert classify_line("  ```python") == LineKind.FENCE
+    assert classify_line("@(layout=split)  ") == LineKind.DECO
+    assert classify_line("@(key=value) Some text") == LineKind.TEXT
+    assert classify_line("  ----  ") == LineKind.DIVIDER_DASH
+    assert classify_line("***") == LineKind.DIVIDER_STAR
+    assert classify_line("___") == LineKind.DIVIDER_UNDERSCORE
+    assert classify_line("===") == LineKind.DIVIDER_VERTICAL
+    assert classify_line("<->") == LineKind.DIVIDER_HORIZONTAL
+    assert classify_line("- - -") == LineKind.TEXT
+    assert classify_line("==") == LineKind.TEXT
+
+
+def test_benchmark_classify_line():
+    lines = [
+        "# Title",
+        "Some text with **bold**",
+        "",
+        "@(layout=split)",
+        "---",
+        "```python",
+        "<!-- comment -->",
+        "===",
+        "<->",
+    ] * 5000
+
+    def separate(line):
+        line.strip().startswith("```")
+        get_header_level(line)
+        is_divider(line, "-")
+        is_divider(line, "=")
+        is_divider(line, "<")
+        contains_deco(line)
+        is_empty(line)
+
+    start = time.perf_counter()
+    for line in lines:
+        separate(line)
+    separate_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for line in lines:
+        classify_line(line)
+    tokenizer_time = time.perf_counter() - start
+
+    print(
+        f"separate checks: {len(lines) / separate_time / 1e6:.2f}M lines/s, "
+        f"classify_line: {len(lines) / tokenizer_time / 1e6:.2f}M lines/s"
+    )
+    assert tokenizer_time < separate_time
+
+
 def test_contains_image():
     assert contains_image("![Alt text](image.jpg)") is True
     assert contains_image("This is an image: ![Alt text](image.jpg)") is True
@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import pytest
+from markdown import markdown
+import moffee.builder as builder
+from moffee.builder import build
+from moffee.markdown import cache as html_cache, md
+from moffee.utils.md_highlight_ext import cache, highlight_cache_dir, highlight_limit
+
+pytest.importorskip("pygments")
+
+EXTENSIONS = [
+    "moffee.utils.md_highlight_ext",
+    "pymdownx.superfences",
+    "pymdownx.inlinehilite",
+]
+
+TEMPLATE_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "moffee", "templates", "base"
+)
+
+
+def convert(text, **config):
+    return markdown(
+        text,
+        extensions=EXTENSIONS,
+        extension_configs={"moffee.utils.md_highlight_ext": config},
+    )
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    cache.clear()
+    html_cache.clear()
+    yield
+    cache.clear()
+    html_cache.clear()
+
+
+def test_same_output_as_pymdownx():
+    text = '```python\nprint("hi")\n```\n\nInline `#!python x = 1` code'
+    expected = markdown(
+        text, extensions=["pymdownx.superfences", "pymdownx.inlinehilite"]
+    )
+    assert convert(text) == expected
+    # Highlighted again from the cache
+    assert convert(text) == expected
+    assert cache.hits == 2
+    assert cache.misses == 2
+
+
+def test_key_covers_language_and_options():
+    convert("```python\nx = 1\n```")
+    convert("```ruby\nx = 1\n```")
+    convert('```python hl_lines="1"\nx = 1\n```')
+    assert cache.misses == 3
+    assert cache.hits == 0
+
+
+def test_repeated_blocks_share_entries():
+    block = "```python\ndef f():\n    return 1\n```\n\n"
+    html = convert(block * 5)
+    assert html.count('<span class="k">def</span>') == 5
+    assert cache.misses == 1
+    assert cache.hits == 4
+
+
+def test_max_lines():
+    long_block = "```python\n" + "x = 1\n" * 50 + "```"
+    html = convert(long_block, max_lines=20)
+    assert '<span class="n">x</span>' not in html
+    assert '<code class="language-python">x = 1' in html
+
+    html = convert(long_block, max_lines=100)
+    assert '<span class="n">x</span>' in html
+    # Inline code is short, and always highlighted
+    assert '<span class="n">x</span>' in convert("`#!python x`", max_lines=1)
+
+
+def test_disk_cache():
+    text = "```python\nprint(1)\n```"
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with highlight_cache_dir(temp_dir):
+            html = convert(text)
+        assert os.listdir(os.path.join(temp_dir, "highlight"))
+
+        cache.clear()
+        with highlight_cache_dir(temp_dir):
+            assert convert(text) == html
+        assert cache.hits == 1
+        assert cache.misses == 0
+
+
+def test_build_stats():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_path = os.path.join(temp_dir, "test.md")
+        with open(doc_path, "w") as f:
+            f.write(
+                "# A\n```python\nx = 1\n```\n---\n# B\nAgain\n```python\nx = 1\n```\n"
+            )
+        output_dir = os.path.join(temp_dir, "output")
+        document = build(doc_path, output_dir, TEMPLATE_DIR)
+        assert document.stats["highlights_rendered"] == 1
+        assert document.stats["highlights_cached"] == 1
+
+
+def test_md_follows_highlight_limit():
+    text = "```python\nx = 1\ny = 2\n```"
+    assert '<span class="n">x</span>' in md(text)
+    with highlight_limit(1):
+        assert '<span class="n">x</span>' not in md(text)
+    assert '<span class="n">x</span>' in md(text)
+
+
+def test_build_limit_reaches_spawned_workers(monkeypatch):
+    # Spawned workers only know what they are passed, unlike forked ones
+    spawn = multiprocessing.get_context("spawn")
+    monkeypatch.setattr(
+        builder, "ProcessPoolExecutor", partial(ProcessPoolExecutor, mp_context=spawn)
+    )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_path = os.path.join(temp_dir, "test.md")
+        with open(doc_path, "w") as f:
+            f.write(
+                "".join(
+                    f"# Slide {i}\n```python\nx = {i}\ny = {i}\n```\n" for i in range(4)
+                )
+            )
+        output_dir = os.path.join(temp_dir, "output")
+        document = build(
+            doc_path, output_dir, TEMPLATE_DIR, jobs=2, max_highlight_lines=1
+        )
+    assert document.html.count('<code class="language-python">x = ') == 4
+    assert '<span class="n">x</span>' not in document.html
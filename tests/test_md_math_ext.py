@@ -0,0 +1,98 @@
+import os
+import tempfile
+import pytest
+from markdown import markdown
+from moffee.builder import render_deck
+from moffee.markdown import md
+from moffee.utils.build_cache import BuildCache
+from moffee.utils.md_math_ext import MathRenderer, math_renderer
+
+pytest.importorskip("latex2mathml")
+
+TEMPLATE_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "moffee", "templates", "base"
+)
+
+
+def convert(text, renderer):
+    with math_renderer(renderer):
+        return markdown(text, extensions=["moffee.utils.md_math_ext"])
+
+
+def test_no_renderer():
+    text = "Inline $a^2$ and\n\n$$\nx\n$$"
+    assert markdown(text, extensions=["moffee.utils.md_math_ext"]) == markdown(text)
+
+
+def test_inline_math():
+    html = convert(r"Inline $a^2$ and \(b_1\), but not $5 and $6", MathRenderer())
+    assert html.count('<math xmlns="http://www.w3.org/1998/Math/MathML"') == 2
+    assert 'display="inline"' in html
+    assert "<msup><mi>a</mi><mn>2</mn></msup>" in html
+    assert "$5 and $6" in html
+
+
+def test_block_math():
+    html = convert("Text\n\n$$\n\\frac{1}{2}\n$$\n\nMore", MathRenderer())
+    assert '<div class="arithmatex"><math' in html
+    assert 'display="block"' in html
+    assert "<mfrac>" in html
+    assert "$$" not in html
+
+
+def test_code_untouched():
+    html = convert("`$a^2$`", MathRenderer())
+    assert "<code>$a^2$</code>" in html
+
+
+def test_invalid_formula_kept():
+    html = MathRenderer().render("{", display=False)
+    assert html == '<code class="math-error">{</code>'
+
+
+def test_formula_cache():
+    renderer = MathRenderer()
+    convert("$a^2$ and $a^2$", renderer)
+    assert renderer.misses == 1
+    assert renderer.hits == 1
+
+
+def test_disk_cache():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        first = MathRenderer(temp_dir)
+        html = first.render("a^2", display=False)
+        assert first.misses == 1
+
+        second = MathRenderer(temp_dir)
+        assert second.render("a^2", display=False) == html
+        assert second.misses == 0
+        assert second.hits == 1
+        # Display mode is part of the key
+        assert second.render("a^2", display=True) != html
+
+
+def test_md_cache_scoped_by_renderer():
+    text = "Scoped $x^3$ formula"
+    assert "<math" not in md(text)
+    with math_renderer(MathRenderer()):
+        assert "<math" in md(text)
+    assert "<math" not in md(text)
+
+
+def test_render_deck_mathml():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_path = os.path.join(temp_dir, "test.md")
+        with open(doc_path, "w") as f:
+            f.write("---\nmath: mathml\n---\n# Math\nEnergy $E=mc^2$\n")
+        cache = BuildCache(os.path.join(temp_dir, ".moffee-cache"))
+
+        document = render_deck(doc_path, TEMPLATE_DIR, cache=cache)
+        assert "<math" in document.html
+        assert "MathJax" not in document.html
+        assert os.path.isdir(os.path.join(temp_dir, ".moffee-cache", "math"))
+
+        with open(doc_path, "w") as f:
+            f.write("# Math\nEnergy $E=mc^2$\n")
+        document = render_deck(doc_path, TEMPLATE_DIR, cache=cache)
+        assert "<math" not in document.html
+        assert "MathJax" in document.html
@@ -36,6 +36,18 @@ def test_deco_with_base_option():
     assert updated_option.default_h3 is True
 
 
+def test_deco_does_not_modify_base_option():
+    base_option = PageOption(styles={"color": "red"})
+    updated_option = parse_deco("@(layout=split, background=blue)", base_option)
+    assert base_option.layout == "content"
+    assert base_option.styles == {"color": "red"}
+    assert updated_option.styles == {"color": "red", "background": "blue"}
+
+    # Untouched values are shared instead of copied
+    assert parse_deco("@(layout=split)", base_option).styles is base_option.styles
+    assert parse_deco("@()", base_option) is base_option
+
+
 def test_deco_with_type_conversion():
     line = "@(default_h1=true, default_h2=false, layout=centered, custom_int=42, custom_float=3.14)"
     base_option = PageOption()
@@ -1,7 +1,7 @@
 import pytest
 import tempfile
 import os
-from moffee.utils.file_helper import redirect_paths
+from moffee.utils.file_helper import redirect_paths, PathResolver
 
 
 @pytest.fixture(scope="module", autouse=True)
@@ -31,9 +31,9 @@ def test_redirect_paths(setup_test_env):
     temp_dir, doc_path, res_dir = setup_test_env
 
     document = """
-Image Path: "image.png"
-Image in resource: "image2.png"
-URL: "http://example.com"
+Image Path: <img src="image.png">
+Image in resource: <img src="image2.png">
+URL: <a href="http://example.com">
 """
 
     redirected_document = redirect_paths(document, doc_path, res_dir)
@@ -50,9 +50,9 @@ def test_redirect_paths_no_res_dir(setup_test_env):
     temp_dir, doc_path, res_dir = setup_test_env
 
     document = """
-Image Path: "image.png"
-Image in resource: "image2.png"
-URL: "http://example.com"
+Image Path: <img src="image.png">
+Image in resource: <img src="image2.png">
+URL: <a href="http://example.com">
 """
 
     redirected_document = redirect_paths(document, doc_path)
@@ -70,8 +70,34 @@ def test_redirect_paths_trivial(setup_test_env):
     temp_dir, doc_path, res_dir = setup_test_env
 
     document = """
-empty: ""
-invalid: "invalid.txt"
+empty: <img src="">
+invalid: <a href="invalid.txt">
 """
     redirected_document = redirect_paths(document, doc_path)
     assert redirected_document == document
+
+
+def test_redirect_paths_attributes_only(setup_test_env):
+    temp_dir, doc_path, res_dir = setup_test_env
+
+    document = """<p class="image.png" title="image.png">"image.png"</p><video poster="image.png">"""
+    redirected_document = redirect_paths(document, doc_path)
+
+    expected_path_image1 = os.path.abspath(os.path.join(temp_dir, "image.png"))
+    assert redirected_document == document.replace(
+        'poster="image.png"', f'poster="{expected_path_image1}"'
+    )
+
+
+def test_redirect_paths_caches_probes(setup_test_env):
+    temp_dir, doc_path, res_dir = setup_test_env
+
+    document = '<img src="image2.png"><a href="missing.txt">' * 10
+    resolver = PathResolver()
+    redirected_document = redirect_paths(document, doc_path, res_dir, resolver)
+
+    assert redirected_document.count(os.path.join(res_dir, "image2.png")) == 10
+    # missing.txt is looked up in res_dir twice, as absolute and as relative to the document
+    assert resolver.probes == 2 + 2
+    # Repeated urls are answered from cache
+    assert resolver.probes_saved == 1 + 9 * (2 + 3)
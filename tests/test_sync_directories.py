@@ -0,0 +1,94 @@
+import os
+import tempfile
+import pytest
+from moffee.utils.file_helper import merge_directories, sync_directories, write_atomic
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def listing(root):
+    return sorted(
+        os.path.relpath(os.path.join(dirpath, name), root)
+        for dirpath, _, filenames in os.walk(root)
+        for name in filenames
+    )
+
+
+@pytest.fixture
+def setup_test_env():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        base_dir = os.path.join(temp_dir, "base")
+        theme_dir = os.path.join(temp_dir, "theme")
+        output_dir = os.path.join(temp_dir, "output")
+        write(os.path.join(base_dir, "index.html"), "base index")
+        write(os.path.join(base_dir, "css", "main.css"), "base css")
+        write(os.path.join(base_dir, "js", "main.js"), "base js")
+        write(os.path.join(theme_dir, "css", "main.css"), "theme css")
+        yield base_dir, theme_dir, output_dir
+
+
+@pytest.mark.parametrize("compare", ["mtime", "hash"])
+def test_sync_merges(setup_test_env, compare):
+    base_dir, theme_dir, output_dir = setup_test_env
+    assert sync_directories(base_dir, output_dir, theme_dir, compare=compare) == 3
+    assert listing(output_dir) == ["css/main.css", "index.html", "js/main.js"]
+    assert read(os.path.join(output_dir, "index.html")) == "base index"
+    assert read(os.path.join(output_dir, "css", "main.css")) == "theme css"
+    assert read(os.path.join(output_dir, "js", "main.js")) == "base js"
+
+    # Nothing changed, nothing written
+    assert sync_directories(base_dir, output_dir, theme_dir, compare=compare) == 0
+
+
+def test_merge_replaces_output(setup_test_env):
+    base_dir, theme_dir, output_dir = setup_test_env
+    write(os.path.join(output_dir, "old", "file.txt"), "old")
+    merge_directories(base_dir, output_dir, theme_dir)
+    assert listing(output_dir) == ["css/main.css", "index.html", "js/main.js"]
+    assert read(os.path.join(output_dir, "css", "main.css")) == "theme css"
+
+
+def test_sync_writes_changes_and_removes_stale(setup_test_env):
+    base_dir, theme_dir, output_dir = setup_test_env
+    sync_directories(base_dir, output_dir, theme_dir)
+
+    write(os.path.join(theme_dir, "css", "main.css"), "edited theme css!")
+    os.remove(os.path.join(base_dir, "js", "main.js"))
+    write(os.path.join(output_dir, "stale", "file.txt"), "stale")
+
+    assert sync_directories(base_dir, output_dir, theme_dir) == 1
+    assert read(os.path.join(output_dir, "css", "main.css")) == "edited theme css!"
+    assert listing(output_dir) == ["css/main.css", "index.html"]
+
+
+def test_sync_keeps_files_written_by_build(setup_test_env):
+    base_dir, theme_dir, output_dir = setup_test_env
+    write(os.path.join(output_dir, "index.html"), "rendered")
+    write(os.path.join(output_dir, "assets", "image.png"), "image")
+
+    sync_directories(base_dir, output_dir, theme_dir, keep=("index.html", "assets"))
+    assert read(os.path.join(output_dir, "index.html")) == "rendered"
+    assert read(os.path.join(output_dir, "assets", "image.png")) == "image"
+
+
+def test_write_atomic_permissions(setup_test_env):
+    _, _, output_dir = setup_test_env
+    os.makedirs(output_dir)
+    plain, atomic = os.path.join(output_dir, "plain"), os.path.join(
+        output_dir, "atomic"
+    )
+    write(plain, "plain")
+    write_atomic(atomic, "atomic")
+    assert read(atomic) == "atomic"
+    # Permissions follow the umask like a plain open(), not private like mkstemp
+    assert os.stat(atomic).st_mode == os.stat(plain).st_mode
+    assert listing(output_dir) == ["atomic", "plain"]